@@ -1,6 +1,9 @@
 from collections import deque
 from scipy.spatial import ConvexHull
+import numpy as np
+import instrumentation
 from kdtree import Node
+from flat_kdtree import FlatNode, FlatTree, EMPTY
 
 
 def color2side(color):
@@ -14,57 +17,66 @@ def color2side(color):
     return res
 
 
+@instrumentation.timed('transform')
 def transform_tree(node, curr_axis=0, up_left_direction=True):
-    next_axis = (curr_axis + 1) % 2
+    # the mirrored copy is described top-down with an explicit stack and the
+    # nodes are then created bottom-up
+    records = []
+    stack = [(node, curr_axis, up_left_direction, None, None)]
 
-    left = None
-    right = None
+    while stack:
+        node, curr_axis, up_left_direction, parent, side = stack.pop()
 
-    if curr_axis == 0 and up_left_direction:
-        if node.left:
-            left = transform_tree(node.left, next_axis, True)
+        if parent is not None:
+            records[parent][side] = len(records)
 
-        if node.right:
-            right = transform_tree(node.right, next_axis, False)
+        records.append([node.data, None, None, getattr(node, 'bucket', None)])
+        index = len(records) - 1
 
-    elif curr_axis == 0 and not up_left_direction:
-        if node.left:
-            right = transform_tree(node.left, next_axis, True)
+        next_axis = (curr_axis + 1) % 2
 
-        if node.right:
-            left = transform_tree(node.right, next_axis, False)
+        # the side of a child is swapped for nodes looking down or right,
+        # its direction depends on the axis only
+        left_side, right_side = (1, 2) if up_left_direction else (2, 1)
+        left_direction = curr_axis == 0
 
-    elif curr_axis == 1 and up_left_direction:
         if node.left:
-            left = transform_tree(node.left, next_axis, False)
+            stack.append((node.left, next_axis, left_direction, index, left_side))
 
         if node.right:
-            right = transform_tree(node.right, next_axis, True)
+            stack.append((node.right, next_axis, not left_direction, index, right_side))
 
-    elif curr_axis == 1 and not up_left_direction:
-        if node.left:
-            right = transform_tree(node.left, next_axis, False)
+    nodes = [None] * len(records)
 
-        if node.right:
-            left = transform_tree(node.right, next_axis, True)
+    for i in range(len(records) - 1, -1, -1):
+        data, left, right, bucket = records[i]
 
-    return Node(node.data, left, right)
+        nodes[i] = Node(data,
+                        None if left is None else nodes[left],
+                        None if right is None else nodes[right],
+                        bucket=bucket)
+
+    instrumentation.count('nodes_visited', len(records))
+
+    return nodes[0]
 
 
 def create_paths(tree):
     result = []
+    stack = [(tree, '')]
+
+    while stack:
+        node, path = stack.pop()
 
-    def iter(node, path):
         if node:
             result.append((node, path))
 
-        if node.left:
-            iter(node.left, path + ' L')
-
         if node.right:
-            iter(node.right, path + ' R')
+            stack.append((node.right, path + ' R'))
+
+        if node.left:
+            stack.append((node.left, path + ' L'))
 
-    iter(tree, '')
     return result
 
 
@@ -72,35 +84,243 @@ def tracing_convex_hull_points(tree):
     paths = create_paths(transform_tree(tree))
     points = [x[0].data for x in paths]
 
-    hull = ConvexHull(points)
-    hull_indices = [x for x in hull.vertices]
+    with instrumentation.phase('hull'):
+        hull = ConvexHull(points)
+
+    hull_indices = set(hull.vertices)
 
     results = []
 
     for i in range(len(points)):
-        if i in hull_indices:
-            path = '[' + str(i) + ']'
-        else:
-            path = '(' + str(i) + ')'
-
         results.append((i, i in hull_indices, points[i], paths[i][1]))
 
     return results
 
+
+# paths are encoded as (depth, bits) with one bit per step, the first step
+# in the most significant bit, so they must fit in a signed 64-bit integer
+MAX_PATH_DEPTH = 62
+
+
+def trace_convex_hull(tree):
+    """
+    Traces the points of the mirrored tree against their convex hull
+
+    Returns arrays (points, on_hull, depths, bits): the points of
+    transform_tree(tree), whether each is a vertex of the convex hull, and
+    its path from the root encoded as depths[i] steps stored in the low
+    bits of bits[i], L as 0 and R as 1, first step most significant. The
+    points of a leaf bucket follow the point of their node and share its
+    path. The mirrored tree is not built; flat trees are traced one level
+    at a time with NumPy.
+    """
+
+    if isinstance(tree, FlatTree):
+        points, depths, bits = _flat_paths(tree)
+    else:
+        points, depths, bits = _node_paths(tree)
+
+    if len(depths) and depths.max() > MAX_PATH_DEPTH:
+        raise ValueError('paths deeper than %d steps cannot be encoded' % MAX_PATH_DEPTH)
+
+    on_hull = np.zeros(len(points), dtype=bool)
+
+    with instrumentation.phase('hull'):
+        on_hull[ConvexHull(points).vertices] = True
+
+    return points, on_hull, depths, bits
+
+
+def _node_paths(tree):
+    points = []
+    depths = []
+    bits = []
+
+    stack = [(tree, 0, True, 0, 0)] if tree else []
+
+    while stack:
+        node, curr_axis, up_left_direction, depth, path = stack.pop()
+
+        points.append(node.data)
+        depths.append(depth)
+        bits.append(path)
+
+        if node.bucket is not None:
+            points.extend(node.bucket.tolist())
+            depths.extend([depth] * len(node.bucket))
+            bits.extend([path] * len(node.bucket))
+
+        next_axis = (curr_axis + 1) % 2
+        left_bit, right_bit = (0, 1) if up_left_direction else (1, 0)
+
+        if node.right:
+            stack.append((node.right, next_axis, curr_axis != 0, depth + 1, path << 1 | right_bit))
+
+        if node.left:
+            stack.append((node.left, next_axis, curr_axis == 0, depth + 1, path << 1 | left_bit))
+
+    return np.array(points, dtype=np.float64).reshape(-1, 2), \
+        np.array(depths, dtype=np.int64), np.array(bits, dtype=np.int64)
+
+
+def _flat_paths(tree):
+    positions = []
+    depths = []
+    bits = []
+
+    nodes = np.array([tree.root] if tree else [], dtype=np.intp)
+    up_left_direction = np.ones(len(nodes), dtype=bool)
+    path = np.zeros(len(nodes), dtype=np.int64)
+    depth = 0
+
+    while len(nodes):
+        positions.append(tree.pivot[nodes])
+        depths.append(np.full(len(nodes), depth, dtype=np.int64))
+        bits.append(path)
+
+        left = tree.children_left[nodes]
+        right = tree.children_right[nodes]
+        has_left = left != EMPTY
+        has_right = right != EMPTY
+
+        left_bit = (~up_left_direction).astype(np.int64)
+
+        nodes = np.concatenate((left[has_left], right[has_right]))
+        path = np.concatenate((path[has_left] << 1 | left_bit[has_left],
+                               path[has_right] << 1 | (1 - left_bit[has_right])))
+        up_left_direction = np.concatenate((np.full(has_left.sum(), depth % 2 == 0),
+                                            np.full(has_right.sum(), depth % 2 != 0)))
+        depth += 1
+
+    if not positions:
+        return np.empty((0, 2)), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    return tree.points[np.concatenate(positions)], np.concatenate(depths), np.concatenate(bits)
+
+
+def match_templates(depths, bits, templates):
+    """
+    Returns for every encoded path the index of the first template that
+    occurs anywhere in it, or -1
+
+    Templates are strings of L and R (spaces are ignored), matched as bit
+    patterns against every window of the paths at once.
+    """
+
+    matched = np.full(len(depths), -1, dtype=np.intp)
+    longest = int(depths.max()) if len(depths) else 0
+
+    for i, template in enumerate(templates):
+        template = template.replace(' ', '')
+        length = len(template)
+        code = int(template.replace('L', '0').replace('R', '1'), 2)
+        mask = (1 << length) - 1
+
+        found = np.zeros(len(depths), dtype=bool)
+
+        for shift in range(longest - length + 1):
+            found |= (depths >= shift + length) & ((bits >> shift) & mask == code)
+
+        matched[(matched == -1) & found] = i
+
+    return matched
+
 templates = ['LRRR', 'RLLL', 'LLLL', 'RRRR']
 
 
+@instrumentation.timed('prune')
 def prune_tree(tree, path=''):
-    if path in templates:
-        return None
+    records = []
+    stack = [(tree, path, None, None)]
+    visited = 0
+
+    while stack:
+        node, path, parent, side = stack.pop()
+        visited += 1
+
+        if path in templates:
+            continue
+
+        if parent is not None:
+            records[parent][side] = len(records)
+
+        records.append([node.data, None, None, getattr(node, 'bucket', None)])
+
+        if node.right:
+            stack.append((node.right, path + 'R', len(records) - 1, 2))
+
+        if node.left:
+            stack.append((node.left, path + 'L', len(records) - 1, 1))
 
-    left = None
-    right = None
+    nodes = [None] * len(records)
+
+    for i in range(len(records) - 1, -1, -1):
+        data, left, right, bucket = records[i]
+
+        nodes[i] = Node(data,
+                        None if left is None else nodes[left],
+                        None if right is None else nodes[right],
+                        bucket=bucket)
+
+    stats = instrumentation.active
+
+    if stats is not None:
+        stats.counters['nodes_visited'] += visited
+        stats.counters['comparisons'] += visited
+
+    return nodes[0] if nodes else None
+
+
+@instrumentation.timed('prune')
+def hull_candidates(tree):
+    """
+    Returns the points kept by prune_tree(transform_tree(tree)) as an
+    (n, 2) array ready for ConvexHull
+
+    Mirroring and template pruning are applied on the fly in one pass over
+    the original tree, without building either intermediate tree. Below
+    the depth of the longest template nothing can be pruned, so whole
+    subtrees are taken at once; for flat trees they are contiguous slices.
+    Points of leaf buckets are kept or pruned with their node.
+    """
+
+    longest = max(len(t) for t in templates)
+
+    chunks = []
+    points = []
+    stack = [(tree, 0, True, '')] if tree else []
+    visited = 0
+
+    while stack:
+        node, curr_axis, up_left_direction, path = stack.pop()
+        visited += 1
+
+        if path in templates:
+            continue
+
+        if len(path) >= longest:
+            if isinstance(node, FlatNode):
+                chunks.append(node.tree.points[node.tree.start[node.index]:node.tree.end[node.index]])
+            else:
+                points.extend(node.points())
+            continue
+
+        points.append(node.data)
+
+        if getattr(node, 'bucket', None) is not None:
+            points.extend(node.bucket.tolist())
+
+        next_axis = (curr_axis + 1) % 2
+        left_side, right_side = ('L', 'R') if up_left_direction else ('R', 'L')
+
+        if node.left:
+            stack.append((node.left, next_axis, curr_axis == 0, path + left_side))
+
+        if node.right:
+            stack.append((node.right, next_axis, curr_axis != 0, path + right_side))
 
-    if tree.left:
-        left = prune_tree(tree.left, path + 'L')
+    chunks.append(np.array(points, dtype=np.float64).reshape(-1, 2))
 
-    if tree.right:
-        right = prune_tree(tree.right, path + 'R')
+    instrumentation.count('nodes_visited', visited)
 
-    return Node(tree.data, left, right)
+    return np.concatenate(chunks)
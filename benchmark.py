@@ -0,0 +1,375 @@
+"""
+    File name: benchmark.py
+    License: MIT
+    Author: Orlov Michael
+    Date created: 18.10.2026
+    Python Version: 3.5
+    Description: reproducible benchmarks for tree building, queries and hulls
+
+    Usage:
+        python benchmark.py run --output results.json
+        python benchmark.py compare baseline.json results.json
+"""
+
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from scipy.spatial import ConvexHull
+
+import kdtree
+import flat_kdtree
+import dual_tree
+import compact
+from algorithms import transform_tree, prune_tree, hull_candidates
+from splitters import widest_axis
+
+
+SEED = 12
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+# relative slowdown over the baseline reported as a regression
+DEFAULT_THRESHOLD = 0.1
+
+QUERIES_COUNT = 1000
+
+
+def uniform(random, size):
+    return random.uniform(0, 4, (size, 2))
+
+
+def clustered(random, size):
+    centers = random.uniform(0, 4, (10, 2))
+    return centers[random.randint(0, len(centers), size)] + random.normal(0, 0.05, (size, 2))
+
+
+def duplicates(random, size):
+    return np.round(random.uniform(0, 4, (size, 2)), 1)
+
+
+def circle(random, size):
+    angles = random.uniform(0, 2 * np.pi, size)
+    return 2 + 2 * np.column_stack((np.cos(angles), np.sin(angles)))
+
+
+DISTRIBUTIONS = {'uniform': uniform, 'clustered': clustered,
+                 'duplicates': duplicates, 'circle': circle}
+
+SCENARIOS = {}
+
+
+def scenario(name):
+    """
+    Registers a benchmark scenario
+
+    A scenario takes the points and a RandomState and returns a callable
+    running the measured work once; setup done before returning is not
+    measured.
+    """
+
+    def register(function):
+        SCENARIOS[name] = function
+        return function
+
+    return register
+
+
+def as_tuples(data):
+    return [x for x in map(tuple, data)]
+
+
+@scenario('build_node')
+def build_node(data, random):
+    points = as_tuples(data)
+    return lambda: kdtree.create(points, 2)
+
+
+@scenario('build_node_leafsize')
+def build_node_leafsize(data, random):
+    points = as_tuples(data)
+    return lambda: kdtree.create(points, 2, axis_selector=widest_axis, leafsize=32)
+
+
+@scenario('build_node_lazy')
+def build_node_lazy(data, random):
+    points = as_tuples(data)
+    return lambda: kdtree.create(points, 2, lazy=True)
+
+
+@scenario('build_flat')
+def build_flat(data, random):
+    return lambda: flat_kdtree.create(data)
+
+
+@scenario('traverse_node')
+def traverse_node(data, random):
+    tree = kdtree.create(as_tuples(data), 2)
+    return lambda: sum(1 for _ in tree.level_order())
+
+
+@scenario('traverse_flat')
+def traverse_flat(data, random):
+    tree = flat_kdtree.create(data)
+    return lambda: sum(1 for _ in tree.level_order())
+
+
+@scenario('hull_raw')
+def hull_raw(data, random):
+    return lambda: ConvexHull(data)
+
+
+@scenario('hull_prune_tree')
+def hull_prune_tree(data, random):
+    tree = kdtree.create(as_tuples(data), 2)
+    return lambda: ConvexHull([x.data for x in prune_tree(transform_tree(tree)).level_order()])
+
+
+@scenario('hull_candidates')
+def hull_fused(data, random):
+    tree = flat_kdtree.create(data)
+    return lambda: ConvexHull(hull_candidates(tree))
+
+
+@scenario('nearest')
+def nearest(data, random):
+    tree = flat_kdtree.create(data)
+    queries = random.uniform(0, 4, (QUERIES_COUNT, 2))
+    return lambda: [tree.nearest(q, 4) for q in queries]
+
+
+def locate(layout):
+    def scenario(data, random):
+        tree = flat_kdtree.create(data, layout=layout)
+        queries = random.uniform(0, 4, (QUERIES_COUNT * 100, 2))
+        return lambda: tree.locate(queries)
+
+    return scenario
+
+
+def nearest_layout(layout):
+    def scenario(data, random):
+        tree = flat_kdtree.create(data, layout=layout)
+        queries = random.uniform(0, 4, (QUERIES_COUNT, 2))
+        return lambda: [tree.nearest(q, 4) for q in queries]
+
+    return scenario
+
+
+for layout in flat_kdtree.LAYOUTS:
+    scenario('locate_' + layout)(locate(layout))
+
+    if layout != 'level':
+        scenario('nearest_' + layout)(nearest_layout(layout))
+
+
+@scenario('nearest_int16')
+def nearest_int16(data, random):
+    tree = compact.create(data, precision='int16')
+    queries = random.uniform(0, 4, (QUERIES_COUNT, 2))
+    return lambda: [tree.nearest(q, 4) for q in queries]
+
+
+@scenario('nearest_node_leafsize')
+def nearest_node_leafsize(data, random):
+    tree = kdtree.create(as_tuples(data), 2, axis_selector=widest_axis, leafsize=32)
+    queries = [x for x in map(tuple, random.uniform(0, 4, (QUERIES_COUNT, 2)))]
+    return lambda: [tree.nearest(q, 4) for q in queries]
+
+
+@scenario('query_batch')
+def query_batch(data, random):
+    tree = flat_kdtree.create(data)
+    queries = random.uniform(0, 4, (QUERIES_COUNT, 2))
+    return lambda: tree.query_batch(queries, 4)
+
+
+@scenario('knn_join')
+def knn_join(data, random):
+    tree = flat_kdtree.create(data)
+    queries = flat_kdtree.create(random.uniform(0, 4, (len(data), 2)))
+    return lambda: dual_tree.knn_join(queries, tree, 4)
+
+
+@scenario('radius_graph')
+def radius_graph(data, random):
+    tree = flat_kdtree.create(data)
+    return lambda: dual_tree.radius_graph(tree, 4 / np.sqrt(len(data)))
+
+
+@scenario('range_count')
+def range_count(data, random):
+    tree = flat_kdtree.create(data)
+    corners = random.uniform(0, 3, (QUERIES_COUNT // 10, 2))
+    return lambda: [tree.range_query(c, c + 1, count_only=True) for c in corners]
+
+
+@scenario('radius_count')
+def radius_count(data, random):
+    tree = flat_kdtree.create(data)
+    centers = random.uniform(0, 4, (QUERIES_COUNT // 10, 2))
+    return lambda: [tree.radius_query(c, 0.5, count_only=True) for c in centers]
+
+
+def compact_mapped(data):
+    """
+    Creates an int16 CompactTree whose exact coordinates are read from a
+    memory-mapped .npy file rather than kept in memory
+    """
+
+    handle, path = tempfile.mkstemp(suffix='.npy')
+    os.close(handle)
+
+    try:
+        np.save(path, data)
+        return compact.create(np.load(path, mmap_mode='r'), precision='int16')
+    finally:
+        # the mapping stays valid after its file is removed on POSIX
+        if os.name == 'posix':
+            os.remove(path)
+
+
+MEMORY = {'memory_node': lambda data: kdtree.create(as_tuples(data), 2),
+          'memory_flat': lambda data: flat_kdtree.create(data),
+          'memory_int16': lambda data: compact.create(data, precision='int16'),
+          'memory_int16_mapped': compact_mapped}
+
+
+def measure_memory(build, data):
+    """
+    Returns the bytes the tree built by build(data) keeps in memory
+
+    A CompactTree references the exact coordinates it re-checks against
+    rather than copying them, so tracemalloc does not see them; they are
+    added unless they are memory-mapped.
+    """
+
+    tracemalloc.start()
+    tree = build(data)
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    if isinstance(tree, compact.CompactTree):
+        used += tree.nbytes - tree.coarse.nbytes
+
+    del tree
+    return used
+
+
+def run(sizes, distributions, scenarios, repeat):
+    results = []
+
+    for distribution in distributions:
+        for size in sizes:
+            random = np.random.RandomState(SEED)
+            data = DISTRIBUTIONS[distribution](random, size)
+
+            for name in scenarios:
+                if name in MEMORY:
+                    record = {'bytes': measure_memory(MEMORY[name], data)}
+                else:
+                    work = SCENARIOS[name](data, np.random.RandomState(SEED))
+                    timings = []
+
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        work()
+                        timings.append(time.perf_counter() - start)
+
+                    record = {'seconds': min(timings)}
+
+                record.update(scenario=name, distribution=distribution, size=size)
+                results.append(record)
+
+                print('%-22s %-11s %9d  %s' % (name, distribution, size,
+                                               '%.6f s' % record['seconds'] if 'seconds' in record
+                                               else '%d bytes' % record['bytes']))
+
+    return results
+
+
+def compare(baseline, current, threshold):
+    """
+    Returns the (record, baseline value, current value) triples that got
+    worse than baseline by more than threshold
+    """
+
+    def key(record):
+        return record['scenario'], record['distribution'], record['size']
+
+    reference = dict((key(record), record) for record in baseline['results'])
+    regressions = []
+
+    for record in current['results']:
+        old = reference.get(key(record))
+
+        if old is None:
+            continue
+
+        for metric in ('seconds', 'bytes'):
+            if metric in record and metric in old and record[metric] > old[metric] * (1 + threshold):
+                regressions.append((record, old[metric], record[metric]))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='reproducible kd-tree benchmarks')
+    commands = parser.add_subparsers(dest='command')
+
+    run_parser = commands.add_parser('run', help='run the benchmarks and write JSON results')
+    run_parser.add_argument('--output', default='bench_results.json')
+    run_parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    run_parser.add_argument('--distributions', nargs='+', choices=sorted(DISTRIBUTIONS),
+                            default=sorted(DISTRIBUTIONS))
+    run_parser.add_argument('--scenarios', nargs='+', choices=sorted(list(SCENARIOS) + list(MEMORY)),
+                            default=sorted(list(SCENARIOS) + list(MEMORY)))
+    run_parser.add_argument('--repeat', type=int, default=3)
+
+    compare_parser = commands.add_parser('compare', help='flag regressions against a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        results = run(args.sizes, args.distributions, args.scenarios, args.repeat)
+        meta = {'seed': SEED, 'repeat': args.repeat, 'python': platform.python_version(),
+                'numpy': np.__version__, 'machine': platform.machine()}
+
+        with open(args.output, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2)
+
+        return 0
+
+    if args.command == 'compare':
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        with open(args.current) as f:
+            current = json.load(f)
+
+        regressions = compare(baseline, current, args.threshold)
+
+        for record, old, new in regressions:
+            print('REGRESSION %-22s %-11s %9d  %.6g -> %.6g (%+.1f%%)' %
+                  (record['scenario'], record['distribution'], record['size'],
+                   old, new, (new / old - 1) * 100))
+
+        print('%d regressions' % len(regressions))
+
+        return 1 if regressions else 0
+
+    parser.print_help()
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,312 @@
+"""
+    File name: bulk_load.py
+    License: MIT
+    Author: Orlov Michael
+    Date created: 18.10.2026
+    Python Version: 3.5
+    Description: out-of-core construction of kd-trees larger than memory
+"""
+
+
+from itertools import islice
+import heapq
+import json
+import os
+import numpy as np
+
+import flat_kdtree
+import storage
+
+
+MANIFEST = 'manifest.json'
+
+
+def read_chunks(source, dimension, chunk_size=1000000):
+    """
+    Yields (m, dimension) float64 arrays of at most chunk_size points
+
+    Source is a path or an iterable. Paths ending in .npy are memory-mapped,
+    .csv and .txt files are parsed line by line, and any other file is read
+    as raw little-endian float64 coordinates. An iterable may yield single
+    points or whole blocks of points.
+    """
+
+    if isinstance(source, str):
+        extension = os.path.splitext(source)[1].lower()
+
+        if extension == '.npy':
+            data = np.load(source, mmap_mode='r')
+        elif extension in ('.csv', '.txt'):
+            data = None
+        else:
+            data = np.memmap(source, dtype='<f8', mode='r').reshape(-1, dimension)
+
+        if data is not None:
+            for lo in range(0, len(data), chunk_size):
+                yield np.array(data[lo:lo + chunk_size], dtype=np.float64)
+            return
+
+        with open(source) as f:
+            while True:
+                lines = list(islice(f, chunk_size))
+
+                if not lines:
+                    return
+
+                yield np.loadtxt(lines, delimiter=',' if extension == '.csv' else None,
+                                 ndmin=2, dtype=np.float64)
+
+    pending = []
+    pending_size = 0
+
+    for item in source:
+        block = np.asarray(item, dtype=np.float64).reshape(-1, dimension)
+        pending.append(block)
+        pending_size += len(block)
+
+        if pending_size >= chunk_size:
+            block = np.concatenate(pending)
+
+            for lo in range(0, len(block) - chunk_size + 1, chunk_size):
+                yield block[lo:lo + chunk_size]
+
+            rest = block[len(block) - len(block) % chunk_size:]
+            pending = [rest]
+            pending_size = len(rest)
+
+    if pending_size:
+        yield np.concatenate(pending)
+
+
+def bulk_load(source, directory, dimension, partitions=16, chunk_size=1000000,
+              sample_size=100000, seed=0):
+    """
+    Builds a partitioned kd-tree from points that need not fit in memory
+
+    The points are streamed once into a spill file while a uniform sample
+    is kept. The top levels of a kd-tree are split at the sample medians,
+    giving the given number of partitions (rounded up to a power of two);
+    a second pass routes every point into the spill file of its partition.
+    Points are ordered by coordinate and then by input index, so a run of
+    equal coordinates at a split is divided between both sides instead of
+    filling one partition.
+    Each partition, which must fit in memory, is then built with
+    flat_kdtree.create and written with storage.save. Returns the
+    PartitionedTree stored in directory.
+    """
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    random = np.random.RandomState(seed)
+
+    spill_path = os.path.join(directory, 'input.spill')
+    sample = np.empty((0, dimension))
+    sample_indices = np.empty(0, dtype=np.int64)
+    sample_keys = np.empty(0)
+    count = 0
+
+    with open(spill_path, 'wb') as spill:
+        for chunk in read_chunks(source, dimension, chunk_size):
+            chunk = np.ascontiguousarray(chunk, dtype='<f8')
+            chunk.tofile(spill)
+
+            # a uniform sample: the points with the smallest random keys
+            sample = np.concatenate((sample, chunk))
+            sample_indices = np.concatenate((sample_indices, np.arange(count, count + len(chunk))))
+            sample_keys = np.concatenate((sample_keys, random.random_sample(len(chunk))))
+            count += len(chunk)
+
+            if len(sample) > sample_size:
+                kept = np.argpartition(sample_keys, sample_size)[:sample_size]
+                sample = sample[kept]
+                sample_indices = sample_indices[kept]
+                sample_keys = sample_keys[kept]
+
+    depth = max(int(np.ceil(np.log2(partitions))), 0)
+    axes = [level % dimension for level in range(depth)]
+    splits, split_indices = _sample_splits(sample, sample_indices, axes)
+
+    part_paths = [os.path.join(directory, 'part-%d' % i) for i in range(2 ** depth)]
+    point_files = [open(path + '.points', 'wb') for path in part_paths]
+    index_files = [open(path + '.indices', 'wb') for path in part_paths]
+
+    try:
+        data = np.memmap(spill_path, dtype='<f8', mode='r', shape=(count, dimension)) if count else \
+            np.empty((0, dimension))
+
+        for lo in range(0, count, chunk_size):
+            chunk = np.array(data[lo:lo + chunk_size])
+            indices = np.arange(lo, lo + len(chunk), dtype='<i8')
+            parts = _route(chunk, axes, splits, split_indices, indices)
+
+            for part in np.unique(parts):
+                chunk[parts == part].tofile(point_files[part])
+                indices[parts == part].tofile(index_files[part])
+
+        del data
+    finally:
+        for f in point_files + index_files:
+            f.close()
+
+    os.remove(spill_path)
+
+    manifest = {'version': 1, 'dimension': dimension, 'size': count,
+                'axes': axes, 'splits': splits.tolist(), 'split_indices': split_indices.tolist(),
+                'partitions': []}
+
+    for path in part_paths:
+        points = np.fromfile(path + '.points', dtype='<f8').reshape(-1, dimension)
+        indices = np.fromfile(path + '.indices', dtype='<i8')
+
+        tree = flat_kdtree.create(points, dimension)
+        tree.indices = indices[tree.indices]
+
+        storage.save(tree, path + '.kdt')
+
+        os.remove(path + '.points')
+        os.remove(path + '.indices')
+
+        manifest['partitions'].append({
+            'file': os.path.basename(path) + '.kdt',
+            'size': len(points),
+            'bounds': [x.tolist() for x in tree.bounds] if len(points) else None})
+
+    with open(os.path.join(directory, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    return PartitionedTree(directory)
+
+
+def _sample_splits(sample, sample_indices, axes):
+    # split values of a complete kd-tree of len(axes) levels over the sample,
+    # in level order, with the input index of the median each was taken from;
+    # medians are taken in (coordinate, index) order, so the sampled points
+    # of a run of equal coordinates fall on both sides in proportion
+    splits = np.zeros(2 ** len(axes) - 1)
+    split_indices = np.zeros(2 ** len(axes) - 1, dtype=np.int64)
+    cells = [(sample, sample_indices)]
+
+    for level, axis in enumerate(axes):
+        next_cells = []
+
+        for i, (cell, indices) in enumerate(cells):
+            node = 2 ** level - 1 + i
+
+            if len(cell):
+                median = np.lexsort((indices, cell[:, axis]))[len(cell) // 2]
+                splits[node] = cell[median, axis]
+                split_indices[node] = indices[median]
+            elif node:
+                splits[node] = splits[(node - 1) // 2]
+                split_indices[node] = split_indices[(node - 1) // 2]
+
+            goes_right = _goes_right(cell[:, axis], indices, splits[node], split_indices[node])
+            next_cells += [(cell[~goes_right], indices[~goes_right]), (cell[goes_right], indices[goes_right])]
+
+        cells = next_cells
+
+    return splits, split_indices
+
+
+def _goes_right(values, indices, split, split_index):
+    return (values > split) | ((values == split) & (indices >= split_index))
+
+
+def _route(points, axes, splits, split_indices=None, indices=None):
+    # without input indices, as for queries, points equal to a split go right
+    node = np.zeros(len(points), dtype=np.intp)
+
+    for axis in axes:
+        if indices is None:
+            goes_right = points[:, axis] >= splits[node]
+        else:
+            goes_right = _goes_right(points[:, axis], indices, splits[node], split_indices[node])
+
+        node = 2 * node + 1 + goes_right
+
+    return node - (2 ** len(axes) - 1)
+
+
+class PartitionedTree(object):
+    """
+    A kd-tree stored as independently built partitions on disk
+
+    The partitions are opened with storage.load, so only the pages a
+    query touches are read. Queries start in the partition a point routes
+    to and visit the other partitions only if their bounding box can
+    still hold an answer.
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, MANIFEST)) as f:
+            manifest = json.load(f)
+
+        self.dimension = manifest['dimension']
+        self.axes = manifest['axes']
+        self.splits = np.array(manifest['splits'])
+        self.partitions = [storage.load(os.path.join(directory, p['file'])) for p in manifest['partitions']]
+        self.bounds = [None if p['bounds'] is None else tuple(np.array(b) for b in p['bounds'])
+                       for p in manifest['partitions']]
+        self.size = manifest['size']
+
+    def __len__(self):
+        return self.size
+
+    def nearest(self, point, k=1):
+        """
+        Returns the k nearest points as (distances, indices) arrays, with
+        indices referring to the order in which the points were loaded
+        """
+
+        point = np.asarray(point, dtype=np.float64)
+        home = int(_route(point[None, :], self.axes, self.splits)[0])
+
+        candidates = []
+
+        for part in [home] + [i for i in range(len(self.partitions)) if i != home]:
+            if self.bounds[part] is None:
+                continue
+
+            if len(candidates) >= k:
+                mins, maxs = self.bounds[part]
+                box_distance = np.sqrt(((point - np.clip(point, mins, maxs)) ** 2).sum())
+
+                if box_distance >= heapq.nsmallest(k, candidates)[-1][0]:
+                    continue
+
+            distances, indices = self.partitions[part].nearest(point, k)
+            candidates += zip(distances.tolist(), indices.tolist())
+
+        best = heapq.nsmallest(k, candidates)
+
+        return np.array([d for d, _ in best]), np.array([i for _, i in best], dtype=np.intp)
+
+    def range_query(self, lo, hi, count_only=False):
+        """
+        Returns the indices of the points in the closed box lo <= x <= hi,
+        or their number when count_only is set
+        """
+
+        return self._gather(lambda mins, maxs: (maxs < lo).any() or (mins > hi).any(),
+                            lambda tree: tree.range_query(lo, hi, count_only), count_only)
+
+    def radius_query(self, center, r, count_only=False):
+        """
+        Returns the indices of the points within distance r of center, or
+        their number when count_only is set
+        """
+
+        center = np.asarray(center, dtype=np.float64)
+
+        return self._gather(lambda mins, maxs: ((center - np.clip(center, mins, maxs)) ** 2).sum() > r * r,
+                            lambda tree: tree.radius_query(center, r, count_only), count_only)
+
+    def _gather(self, outside, query, count_only):
+        results = [query(tree) for tree, bounds in zip(self.partitions, self.bounds)
+                   if bounds is not None and not outside(*bounds)]
+
+        if count_only:
+            return sum(results)
+
+        return np.concatenate(results) if results else np.empty(0, dtype=np.intp)
@@ -0,0 +1,208 @@
+"""
+    File name: compact.py
+    License: MIT
+    Author: Orlov Michael
+    Date created: 18.10.2026
+    Python Version: 3.5
+    Description: flat kd-trees with coordinates stored at reduced precision
+
+    Usage:
+        tree = compact.create(points, precision='int16')
+        distances, indices = tree.nearest((1, 1), 4)
+"""
+
+
+import mmap
+import numpy as np
+import flat_kdtree
+from flat_kdtree import FlatTree
+
+
+PRECISIONS = {'float64': np.float64, 'float32': np.float32, 'int32': np.int32, 'int16': np.int16}
+
+# relative slack added to the coarse search margins against rounding in the
+# coarse pass itself
+SLACK = 1e-9
+
+
+class CompactTree(object):
+    """
+    A FlatTree whose own coordinates are stored at reduced precision
+
+    The tree arrays hold codes: float32 offsets from the center of the
+    bounding box, or integers quantized over the box with the same step on
+    every axis, so distances between codes are distances between points
+    divided by scale. Node links are stored as 32-bit integers when they
+    fit. The exact coordinates are read, only for the final check, from
+    source, the (n, k) float64 array of points the tree was created from,
+    which is referenced rather than copied and so stays resident with the
+    tree, unless it is memory-mapped from a file (np.load with mmap_mode,
+    or storage) and paged in only for the candidates of a query.
+
+    Queries first search the codes with their region widened by error, the
+    largest distance between a point and its decoded code, which returns
+    every point that can match; the candidates are then checked against
+    the exact coordinates, so answers are the same as from a FlatTree.
+    """
+
+    def __init__(self, tree, source, precision='float32'):
+        if precision not in PRECISIONS:
+            raise ValueError('precision must be one of %s' % ', '.join(sorted(PRECISIONS)))
+
+        dtype = PRECISIONS[precision]
+        points = tree.points
+
+        if len(points):
+            mins, maxs = tree.bounds
+            offset = (mins + maxs) / 2
+            half_extent = float((maxs - mins).max()) / 2
+        else:
+            offset = np.zeros(tree.dimension)
+            half_extent = 0.0
+
+        if np.issubdtype(dtype, np.integer) and half_extent > 0:
+            scale = half_extent / np.iinfo(dtype).max
+            codes = np.rint((points - offset) / scale).astype(dtype)
+        else:
+            scale = 1.0
+            codes = (points - offset).astype(dtype)
+
+        decoded = codes * scale + offset
+
+        self.precision = precision
+        self.source = source
+        self.offset = offset
+        self.scale = scale
+        self.error = float(np.sqrt(((decoded - points) ** 2).sum(axis=1)).max()) if len(points) else 0.0
+
+        # node links and positions fit in 32 bits below 2**31 points
+        links = [tree.indices, tree.pivot, tree.children_left, tree.children_right, tree.start, tree.end]
+
+        if len(points) < np.iinfo(np.int32).max:
+            links = [x.astype(np.int32) for x in links]
+
+        indices, pivot, left, right, start, end = links
+
+        self.coarse = FlatTree(codes, indices, pivot, tree.split_axis, left, right, start, end,
+                               tree.height, tree.root)
+
+        # widening of coarse regions in code units
+        self._margin = self.error / scale + SLACK * (1 + half_extent / scale)
+
+    def __repr__(self):
+        return '<%(cls)s - %(n)d points, %(k)d dimensions, %(precision)s>' % \
+               dict(cls=self.__class__.__name__, n=len(self), k=self.dimension, precision=self.precision)
+
+    def __len__(self):
+        return len(self.coarse)
+
+    def __nonzero__(self):
+        return bool(self.coarse)
+
+    __bool__ = __nonzero__
+
+    @property
+    def dimension(self):
+        return self.coarse.dimension
+
+    @property
+    def nbytes(self):
+        """
+        Returns the number of bytes the tree keeps in memory: the tree
+        arrays and source, unless source is memory-mapped
+        """
+
+        return self.coarse.nbytes + (0 if _mapped(self.source) else self.source.nbytes)
+
+    def encode(self, points):
+        """
+        Returns points in code units, unrounded
+        """
+
+        return (np.asarray(points, dtype=np.float64) - self.offset) / self.scale
+
+    def nearest(self, point, k=1):
+        """
+        Returns the k points of the tree nearest to point as arrays
+        (distances, indices), as FlatTree.nearest
+
+        The k nearest codes bound the k-th distance from above; every point
+        that can lie within that bound is then taken from the codes by a
+        radius search and ranked by exact distance.
+        """
+
+        point = np.asarray(point, dtype=np.float64)
+        distances, _ = self.coarse.nearest(self.encode(point), k)
+
+        if not len(distances):
+            return distances, np.empty(0, dtype=self.coarse.indices.dtype)
+
+        bound = distances[-1] + 2 * self._margin
+        candidates = self.coarse.radius_query(self.encode(point), bound)
+
+        exact = np.sqrt(((self.source[candidates] - point) ** 2).sum(axis=1))
+        order = np.lexsort((candidates, exact))[:k]
+
+        return exact[order], candidates[order]
+
+    def range_query(self, lo, hi, count_only=False):
+        """
+        Returns the points lying in the closed box lo <= x <= hi, as
+        FlatTree.range_query
+        """
+
+        lo = np.asarray(lo, dtype=np.float64)
+        hi = np.asarray(hi, dtype=np.float64)
+
+        candidates = self.coarse.range_query(self.encode(lo) - self._margin, self.encode(hi) + self._margin)
+        points = self.source[candidates]
+        found = candidates[((points >= lo) & (points <= hi)).all(axis=1)]
+
+        return len(found) if count_only else found
+
+    def radius_query(self, center, r, count_only=False):
+        """
+        Returns the points lying within distance r of center, as
+        FlatTree.radius_query
+        """
+
+        center = np.asarray(center, dtype=np.float64)
+
+        candidates = self.coarse.radius_query(self.encode(center), r / self.scale + self._margin)
+        found = candidates[((self.source[candidates] - center) ** 2).sum(axis=1) <= r * r]
+
+        return len(found) if count_only else found
+
+
+def create(points, dimension=None, axis=0, precision='float32'):
+    """
+    Creates a CompactTree from a sequence of points or an (n, k) array
+
+    The tree has the shape of flat_kdtree.create. A float64 array is kept
+    as the source of exact coordinates as it is; anything else is
+    converted to one first. Float32 codes halve and int16 codes quarter
+    the coordinate storage of the tree, but most of the saving comes from
+    the 32-bit node links: in 2-d an int16 tree takes 29 bytes per point
+    against 65 for a FlatTree. With source in memory, 16 bytes more per
+    point, that is 1.4 times less; only with a memory-mapped source is
+    it 2.2 times less.
+    """
+
+    source = np.asarray(points, dtype=np.float64)
+    tree = flat_kdtree.create(source, dimension, axis)
+
+    return CompactTree(tree, source.reshape(len(tree), tree.dimension), precision)
+
+
+def _mapped(array):
+    """
+    Returns True if array is a view of a memory-mapped file
+    """
+
+    while array is not None:
+        if isinstance(array, (np.memmap, mmap.mmap)):
+            return True
+
+        array = getattr(array, 'base', None)
+
+    return False
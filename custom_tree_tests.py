@@ -5,9 +5,28 @@ import scipy
 import numpy as np
 
 import kdtree
+import flat_kdtree
+import storage
+import bulk_load
+import benchmark
+import instrumentation
+import splitters
+import query_cache
+import render
+import dual_tree
+import compact
+import tempfile
+import os
+import shutil
+import tracemalloc
+import sys
+import subprocess
+import multiprocessing
 import visualization
-from algorithms import transform_tree, prune_tree, create_paths
+from algorithms import transform_tree, prune_tree, create_paths, hull_candidates, \
+    tracing_convex_hull_points, trace_convex_hull, match_templates
 from visualization import visualize_2d_tree_by_levels
+import matplotlib.pyplot as plt
 
 
 def get_test_points():
@@ -132,6 +151,30 @@ class TestTree(unittest.TestCase):
     #     for i in range(len(transformed_data)):
     #         self.assertTrue(are_equal_double_tuple(transformed_test_data[i], transformed_data[i]))
 
+    def test_levels_slider(self):
+        tree = kdtree.create([x for x in map(tuple, generate_points(200))], 2)
+
+        figure = plt.figure()
+
+        try:
+            slider = visualize_2d_tree_by_levels(tree, show=False)
+            axes = figure.axes[0]
+            figure.canvas.draw()
+
+            artists_count = len(axes.get_children())
+            levels = visualization.create_level_artists(plt.figure().add_subplot(1, 1, 1), tree)
+
+            self.assertEqual(len(levels), tree.height)
+
+            slider.set_val(2)
+            slider.set_val(tree.height)
+
+            self.assertEqual(len(axes.get_children()), artists_count)
+            self.assertEqual(slider.val, tree.height)
+            self.assertTrue(all(x.get_visible() for x in axes.collections if x.get_animated()))
+        finally:
+            plt.close('all')
+
     def test_foo(self):
         tree = transform_tree(kdtree.create(points=get_test_points(), dimension=2))
 
@@ -142,6 +185,201 @@ class TestTree(unittest.TestCase):
 
         #assert False
 
+    def test_hull_candidates(self):
+        np.random.seed(12)
+        points = generate_points(500)
+
+        expected = sorted(x.data for x in prune_tree(transform_tree(kdtree.create(
+            [x for x in map(tuple, points)], 2))).level_order())
+
+        for tree in (kdtree.create([x for x in map(tuple, points)], 2), flat_kdtree.create(points)):
+            candidates = hull_candidates(tree)
+
+            self.assertEqual(sorted(map(tuple, candidates.tolist())), expected)
+            self.assertTrue(are_equal_double_lists(sorted(create_convex_hull(tree)),
+                                                   sorted(map(tuple, candidates[get_hull_indices(candidates)].tolist()))))
+
+    def test_trace_convex_hull(self):
+        np.random.seed(12)
+        points = generate_points(500)
+        tree = kdtree.create([x for x in map(tuple, points)], 2)
+
+        expected = dict((x[2], (x[1], x[3].replace(' ', ''))) for x in tracing_convex_hull_points(tree))
+
+        for traced_tree in (tree, flat_kdtree.create(points)):
+            traced_points, on_hull, depths, bits = trace_convex_hull(traced_tree)
+            paths = [''.join('LR'[int(b) >> (d - 1 - i) & 1] for i in range(d)) for d, b in zip(depths, bits)]
+
+            self.assertEqual(len(traced_points), len(expected))
+
+            for point, hull_vertex, path in zip(map(tuple, traced_points.tolist()), on_hull, paths):
+                self.assertEqual(expected[point], (hull_vertex, path))
+
+            matched = match_templates(depths, bits, ['L R R R', 'RLLL'])
+
+            for path, index in zip(paths, matched):
+                self.assertEqual(index, 0 if 'LRRR' in path else 1 if 'RLLL' in path else -1)
+
+    def test_hulls_with_leaf_buckets(self):
+        np.random.seed(12)
+        points = generate_points(2000)
+        tree = kdtree.create([x for x in map(tuple, points)], 2, leafsize=16)
+
+        def hull(candidates):
+            candidates = np.asarray(candidates)
+            return sorted(map(tuple, candidates[get_hull_indices(candidates)].tolist()))
+
+        traced_points, on_hull, _, _ = trace_convex_hull(tree)
+
+        self.assertEqual(len(traced_points), len(points))
+        self.assertEqual(sorted(map(tuple, traced_points[on_hull].tolist())), hull(points))
+        self.assertEqual(hull(hull_candidates(tree)), hull(points))
+        self.assertEqual(prune_tree(transform_tree(tree)).size, len(hull_candidates(tree)))
+
+    def test_parallel_create(self):
+        np.random.seed(12)
+        points = [x for x in map(tuple, generate_points(500))]
+
+        serial_tree = kdtree.create(points, 2)
+        parallel_tree = kdtree.create(points, 2, workers=3)
+
+        self.assertEqual([(x.data, x.axis) for x in serial_tree.level_order()],
+                         [(x.data, x.axis) for x in parallel_tree.level_order()])
+
+        serial_tree = kdtree.create(points, 2, leafsize=16, axis_selector=splitters.widest_axis)
+        parallel_tree = kdtree.create(points, 2, workers=3, leafsize=16, axis_selector=splitters.widest_axis)
+
+        self.assertEqual([(x.data, x.axis, x.size) for x in serial_tree.level_order()],
+                         [(x.data, x.axis, x.size) for x in parallel_tree.level_order()])
+
+    def test_lazy_create(self):
+        np.random.seed(12)
+        points = [x for x in map(tuple, generate_points(2000))]
+
+        expected = kdtree.create(points, 2).nearest((0.1, 0.1), 3)
+
+        with instrumentation.collect() as stats:
+            lazy_tree = kdtree.create(points, 2, lazy=True)
+            self.assertEqual(stats.counters['splits'], 1)
+
+            self.assertEqual(lazy_tree.nearest((0.1, 0.1), 3), expected)
+            self.assertLess(stats.counters['points_sorted'], len(points) * 2)
+
+        lazy_tree.insert((5, 5))
+        self.assertEqual(lazy_tree.size, len(points) + 1)
+
+        # reading bounds after an update takes the boxes of deferred
+        # subtrees from their blocks instead of splitting them
+        with instrumentation.collect() as stats:
+            lazy_tree = kdtree.create(points, 2, lazy=True)
+            lazy_tree.insert((1, 1))
+            lazy_tree.nearest((3, 3))
+
+            self.assertLess(stats.counters['splits'], 100)
+
+            splits = stats.counters['splits']
+            bounds = kdtree.create(points, 2, lazy=True).bounds
+
+            self.assertEqual(stats.counters['splits'], splits + 1)
+            self.assertEqual(bounds, (tuple(np.min(points, axis=0)), tuple(np.max(points, axis=0))))
+
+        eager_tree = kdtree.create(points, 2, leafsize=8)
+        lazy_tree = kdtree.create(points, 2, leafsize=8, lazy=True)
+
+        self.assertEqual([(x.data, x.axis, x.size) for x in lazy_tree.level_order()],
+                         [(x.data, x.axis, x.size) for x in eager_tree.level_order()])
+        self.assertEqual(lazy_tree.height, eager_tree.height)
+
+    def test_insert_remove(self):
+        np.random.seed(12)
+        points = [x for x in map(tuple, np.round(generate_points(2000), 1))]
+
+        tree = kdtree.create([], 2)
+
+        for point in points:
+            tree.insert(point)
+
+        self.assertEqual(tree.size, len(points))
+        self.assertLess(tree.height, 30)
+
+        for point in points[:1500]:
+            tree.remove(point)
+
+        self.assertEqual(tree.size, 500)
+        self.assertEqual(sorted(x.data for x in tree.inorder()), sorted(points[1500:]))
+
+        for node in tree.inorder():
+            if node.left:
+                self.assertTrue(all(x.data[node.axis] <= node.data[node.axis] for x in node.left.inorder()))
+
+            if node.right:
+                self.assertTrue(all(x.data[node.axis] >= node.data[node.axis] for x in node.right.inorder()))
+
+        with self.assertRaises(ValueError):
+            tree.remove((-1.0, -1.0))
+
+    def test_cached_metadata(self):
+        np.random.seed(12)
+        points = [x for x in map(tuple, generate_points(300))]
+
+        tree = kdtree.create(points[:200], 2)
+
+        for point in points[200:]:
+            tree.insert(point)
+
+        for point in points[:100]:
+            tree.remove(point)
+
+        for node in tree.inorder():
+            subtree = [x.data for x in node.inorder()]
+
+            self.assertEqual(node.size, len(subtree))
+            self.assertEqual(node.height, 1 + max(node.left.height if node.left else 0,
+                                                  node.right.height if node.right else 0))
+            self.assertEqual(node.bounds, (tuple(np.min(subtree, axis=0)), tuple(np.max(subtree, axis=0))))
+
+        self.assertTrue(kdtree.create(points, 2).is_balanced)
+
+    def test_pickled_trees(self):
+        tree = load_test_tree()
+
+        self.assertEqual(tree.height, 6)
+        self.assertEqual(tree.size, len(list(tree.inorder())))
+        self.assertEqual(tree.version, 1)
+
+        # a tree pickled before the cached metadata existed
+        def strip(node):
+            if node is None:
+                return None
+
+            legacy = kdtree.Node.__new__(kdtree.Node)
+            legacy.__dict__ = dict(data=node.data, left=strip(node.left), right=strip(node.right))
+            return legacy
+
+        np.random.seed(12)
+        tree = kdtree.create([x for x in map(tuple, generate_points(300))], 2)
+        loaded = pickle.loads(pickle.dumps(strip(tree)))
+
+        self.assertEqual([x.axis for x in loaded.level_order()], [x.axis for x in tree.level_order()])
+        self.assertEqual((loaded.size, loaded.height, loaded.bounds), (tree.size, tree.height, tree.bounds))
+        self.assertEqual(loaded.nearest((2, 2), 5), tree.nearest((2, 2), 5))
+
+    def test_deep_tree_traversals(self):
+        depth = 5000
+        tree = kdtree.Node((0.0, 0.0))
+
+        for i in range(1, depth):
+            tree = kdtree.Node((float(i), float(i)), tree, kdtree.Node(), i % 2)
+
+        self.assertEqual(len(list(tree.inorder())), depth)
+        self.assertEqual(transform_tree(tree).height, depth)
+        self.assertEqual(len(create_paths(transform_tree(tree))), depth)
+        self.assertEqual(prune_tree(tree).size, 4)
+        self.assertEqual(visualization.create_visualization_tree(tree).height, depth + 1)
+
+        self.assertEqual(len(tree._find((0.0, 0.0))), depth)
+        self.assertEqual(tree.remove((0.0, 0.0)).size, depth - 1)
+
     def test_pruned_tree_hull(self):
         np.random.seed(12)
         points_count = 20
@@ -166,6 +404,655 @@ class TestTree(unittest.TestCase):
         self.assertTrue(are_equal_double_lists(hull_tree, hull_pruned_tree))
 
 
+class TestNearest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(3)
+        self.points = generate_points(1000)
+        self.queries = np.random.uniform(-1, 5, (30, 2))
+
+    def brute_force(self, query, k):
+        return np.sort(np.sqrt(((self.points - query) ** 2).sum(axis=1)))[:k]
+
+    def test_node_tree(self):
+        tree = kdtree.create([x for x in map(tuple, self.points)], 2)
+
+        for query in self.queries:
+            for k in (1, 7):
+                distances, points = tree.nearest(tuple(query), k)
+
+                self.assertTrue(np.allclose(distances, self.brute_force(query, k)))
+                self.assertEqual(len(points), k)
+
+    def test_flat_tree(self):
+        tree = flat_kdtree.create(self.points)
+
+        for query in self.queries:
+            for k in (1, 7):
+                distances, indices = tree.nearest(query, k)
+                found = np.sqrt(((self.points[indices] - query) ** 2).sum(axis=1))
+
+                self.assertTrue(np.allclose(distances, self.brute_force(query, k)))
+                self.assertTrue(np.allclose(found, distances))
+
+    def test_query_batch(self):
+        tree = flat_kdtree.create(self.points)
+
+        for k in (1, 7):
+            distances, indices = tree.query_batch(self.queries, k)
+
+            self.assertEqual(distances.shape, (len(self.queries), k))
+
+            for i, query in enumerate(self.queries):
+                found = np.sqrt(((self.points[indices[i]] - query) ** 2).sum(axis=1))
+
+                self.assertTrue(np.allclose(distances[i], self.brute_force(query, k)))
+                self.assertTrue(np.allclose(found, distances[i]))
+
+    def test_query_batch_small_tree(self):
+        distances, indices = flat_kdtree.create(self.points[:3]).query_batch(self.queries, 5)
+
+        self.assertTrue(np.isinf(distances[:, 3:]).all())
+        self.assertTrue((indices[:, 3:] == -1).all())
+        self.assertEqual(sorted(indices[0, :3].tolist()), [0, 1, 2])
+
+    def test_invalid_k(self):
+        with self.assertRaises(ValueError):
+            flat_kdtree.create(self.points).nearest((0, 0), k=0)
+
+    def test_approximate(self):
+        eps = 1.0
+        trees = [kdtree.create([x for x in map(tuple, self.points)], 2, leafsize=8),
+                 flat_kdtree.create(self.points)]
+
+        for tree in trees:
+            with instrumentation.collect() as exact_stats:
+                for query in self.queries:
+                    tree.nearest(tuple(query), 5)
+
+            with instrumentation.collect() as approximate_stats:
+                for query in self.queries:
+                    distances, _ = tree.nearest(tuple(query), 5, eps=eps)
+                    self.assertTrue((np.array(distances) <= (1 + eps) * self.brute_force(query, 5) + 1e-12).all())
+
+            self.assertLessEqual(approximate_stats.counters['nodes_visited'], exact_stats.counters['nodes_visited'])
+
+            with instrumentation.collect() as capped_stats:
+                for query in self.queries:
+                    self.assertEqual(len(tree.nearest(tuple(query), 5, max_leaves=2)[0]), 5)
+
+            self.assertLessEqual(capped_stats.counters['leaves_visited'], 2 * len(self.queries))
+
+            with self.assertRaises(ValueError):
+                tree.nearest((0, 0), eps=-1)
+
+
+class TestRegionQueries(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(5)
+        self.points = generate_points(3000)
+        self.points[:500] = np.round(self.points[:500])
+        self.tree = flat_kdtree.create(self.points)
+
+    def test_range_query(self):
+        for lo, hi in [((1, 1), (2.5, 3)), ((-1, -1), (5, 5)), ((1, 1), (1, 1)), ((5, 5), (6, 6))]:
+            expected = np.flatnonzero(((self.points >= lo) & (self.points <= hi)).all(axis=1))
+
+            self.assertEqual(sorted(self.tree.range_query(lo, hi).tolist()), expected.tolist())
+            self.assertEqual(self.tree.range_query(lo, hi, count_only=True), len(expected))
+
+    def test_radius_query(self):
+        for center, r in [((2, 2), 1.0), ((0, 0), 0.5), ((2, 2), 10.0), ((1, 1), 0.0)]:
+            expected = np.flatnonzero(((self.points - center) ** 2).sum(axis=1) <= r * r)
+
+            self.assertEqual(sorted(self.tree.radius_query(center, r).tolist()), expected.tolist())
+            self.assertEqual(self.tree.radius_query(center, r, count_only=True), len(expected))
+
+    def test_count_only_memory(self):
+        tree = flat_kdtree.create(generate_points(100000))
+
+        tracemalloc.start()
+        count = tree.range_query((0.1, 0.1), (3.9, 3.9), count_only=True)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        # far below the 8 bytes per match that listing the matches takes
+        self.assertGreater(count, 90000)
+        self.assertLess(peak, count)
+
+
+class TestCompactTree(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(14)
+        self.points = np.round(generate_points(3000) * 1000 + 5e6, 1)
+        self.tree = flat_kdtree.create(self.points)
+
+    def test_exact_answers(self):
+        queries = self.points[:20] + np.random.uniform(-50, 50, (20, 2))
+
+        for precision in sorted(compact.PRECISIONS):
+            tree = compact.create(self.points, precision=precision)
+
+            for query in queries:
+                self.assertTrue(np.allclose(tree.nearest(query, 4)[0], self.tree.nearest(query, 4)[0]))
+                self.assertEqual(sorted(tree.radius_query(query, 200)), sorted(self.tree.radius_query(query, 200)))
+                self.assertEqual(tree.range_query(query - 150, query + 150, count_only=True),
+                                 self.tree.range_query(query - 150, query + 150, count_only=True))
+
+    def test_smaller(self):
+        tree = compact.create(self.points, precision='int16')
+
+        self.assertEqual(tree.coarse.points.dtype, np.int16)
+        self.assertEqual(tree.nbytes, tree.coarse.nbytes + self.points.nbytes)
+        self.assertLess(tree.nbytes * 1.3, self.tree.nbytes)
+        self.assertGreater(tree.error, 0)
+
+        with self.assertRaises(ValueError):
+            compact.create(self.points, precision='float16')
+
+    def test_mapped_source(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'points.npy')
+            np.save(path, self.points)
+
+            tree = compact.create(np.load(path, mmap_mode='r'), precision='int16')
+
+            self.assertEqual(tree.nbytes, tree.coarse.nbytes)
+            self.assertLess(tree.nbytes * 2, self.tree.nbytes)
+
+            for query in self.points[:20] + 10:
+                self.assertEqual(tree.nearest(query, 4)[1].tolist(), self.tree.nearest(query, 4)[1].tolist())
+
+            del tree
+
+
+class TestStorage(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'tree.kdt')
+
+    def test_round_trip(self):
+        np.random.seed(9)
+        points = generate_points(2000)
+        tree = flat_kdtree.create(points)
+
+        storage.save(tree, self.path)
+
+        for mmap in (True, False):
+            loaded = storage.load(self.path, mmap=mmap)
+
+            self.assertEqual(loaded.height, tree.height)
+            self.assertTrue((loaded.points == tree.points).all())
+            self.assertEqual([x.data for x in loaded.level_order()], [x.data for x in tree.level_order()])
+            self.assertTrue((loaded.query_batch(points[:50], 3)[1] == tree.query_batch(points[:50], 3)[1]).all())
+
+    def test_node_tree(self):
+        tree = kdtree.create(get_test_points(), 2)
+
+        storage.save(tree, self.path)
+
+        self.assertEqual([x.data for x in storage.load(self.path).level_order()],
+                         [x.data for x in tree.level_order()])
+
+    def test_not_a_tree(self):
+        with self.assertRaises(ValueError):
+            storage.load("test_tree.data")
+
+    def test_worker_processes(self):
+        np.random.seed(9)
+        points = generate_points(2000)
+        tree = flat_kdtree.create(points)
+        expected = tree.query_batch(points[:50], 3)[1].tolist()
+
+        storage.save(tree, self.path)
+        block = storage.publish(tree)
+
+        try:
+            with multiprocessing.Pool(2) as pool:
+                results = pool.map(query_in_worker, [('load', self.path, points[:50]),
+                                                     ('attach', block.name, points[:50])])
+
+            attached = storage.attach(block.name)
+            self.assertTrue((attached.points == tree.points).all())
+            self.assertFalse(attached.points.flags.writeable)
+            del attached
+        finally:
+            block.close()
+            block.unlink()
+
+        self.assertEqual(results, [expected, expected])
+
+    def test_independent_process(self):
+        np.random.seed(9)
+        points = generate_points(2000)
+        tree = flat_kdtree.create(points)
+        block = storage.publish(tree)
+
+        script = 'import storage; print(storage.attach(%r).query_batch([[1, 1]], 3)[1].tolist())' % block.name
+
+        try:
+            output = subprocess.run([sys.executable, '-c', script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+
+            self.assertEqual(output.stdout.decode().strip(), str(tree.query_batch([[1, 1]], 3)[1].tolist()))
+            self.assertNotIn(b'leaked', output.stderr)
+
+            # the block outlives the independent process
+            self.assertTrue((storage.attach(block.name).points == tree.points).all())
+        finally:
+            block.close()
+            block.unlink()
+
+    def test_failed_publish(self):
+        tree = flat_kdtree.create(generate_points(100))
+        broken = flat_kdtree.FlatTree(tree.points, tree.indices, tree.pivot, tree.split_axis,
+                                      tree.children_left, tree.children_right, tree.start, tree.end[:-1],
+                                      tree.height, tree.root)
+        name = 'kdtree_test_%d' % os.getpid()
+
+        with self.assertRaises(ValueError):
+            storage.publish(broken, name)
+
+        with self.assertRaises(FileNotFoundError):
+            storage.attach(name)
+
+
+class TestBulkLoad(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(10)
+        self.points = generate_points(5000)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def check(self, tree):
+        self.assertEqual(len(tree), len(self.points))
+
+        for query in self.points[:20] + 0.01:
+            distances, indices = tree.nearest(query, 3)
+            expected = np.sort(np.sqrt(((self.points - query) ** 2).sum(axis=1)))[:3]
+
+            self.assertTrue(np.allclose(distances, expected))
+            self.assertTrue(np.allclose(np.sqrt(((self.points[indices] - query) ** 2).sum(axis=1)), expected))
+
+        inside = ((self.points >= (1, 1)) & (self.points <= (2, 3))).all(axis=1)
+
+        self.assertEqual(sorted(tree.range_query((1, 1), (2, 3)).tolist()), np.flatnonzero(inside).tolist())
+        self.assertEqual(tree.radius_query((2, 2), 1, count_only=True),
+                         (((self.points - 2) ** 2).sum(axis=1) <= 1).sum())
+
+    def test_from_generator(self):
+        points = (point for point in self.points)
+
+        self.check(bulk_load.bulk_load(points, self.directory, 2, partitions=8, chunk_size=700))
+
+    def test_from_file(self):
+        path = os.path.join(self.directory, 'points.npy')
+        np.save(path, self.points)
+
+        bulk_load.bulk_load(path, self.directory, 2, partitions=4, chunk_size=1000, sample_size=500)
+
+        self.check(bulk_load.PartitionedTree(self.directory))
+
+    def test_duplicates(self):
+        self.points = np.repeat(np.where(np.random.random_sample((3000, 1)) < 0.5, 1.0, 2.0), 2, axis=1)
+
+        tree = bulk_load.bulk_load(self.points, self.directory, 2, partitions=8, chunk_size=700)
+
+        self.assertLessEqual(max(len(x) for x in tree.partitions), 2 * len(self.points) // 8)
+        self.check(tree)
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_run_and_compare(self):
+        baseline = {'results': benchmark.run([200], ['uniform', 'circle'], ['build_flat', 'memory_flat'], 1)}
+        self.assertEqual(len(baseline['results']), 4)
+
+        slower = {'results': [dict(x) for x in baseline['results']]}
+        slower['results'][0]['seconds'] *= 2
+
+        self.assertEqual(benchmark.compare(baseline, baseline, 0.1), [])
+        self.assertEqual(len(benchmark.compare(baseline, slower, 0.1)), 1)
+
+
+class TestSplitStrategies(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(12)
+        self.points = [x for x in map(tuple, np.round(generate_points(2000), 1))]
+
+    def check_nearest(self, tree, points):
+        data = np.array(points)
+
+        for query in generate_points(20):
+            distances, _ = tree.nearest(tuple(query), 5)
+            expected = np.sort(np.sqrt(((data - query) ** 2).sum(axis=1)))[:5]
+
+            self.assertTrue(np.allclose(distances, expected))
+
+    def test_strategies(self):
+        for splitter in (splitters.median_split, splitters.sliding_midpoint_split, splitters.three_way_split):
+            for axis_selector in (splitters.cycle_axis, splitters.widest_axis):
+                tree = kdtree.create(self.points, 2, splitter=splitter, axis_selector=axis_selector)
+
+                self.assertEqual(tree.size, len(self.points))
+                self.check_nearest(tree, self.points)
+
+                for node in tree.inorder():
+                    if node.left:
+                        self.assertTrue(all(x.data[node.axis] <= node.data[node.axis] for x in node.left.inorder()))
+
+                    if node.right:
+                        self.assertTrue(all(x.data[node.axis] >= node.data[node.axis] for x in node.right.inorder()))
+
+    def test_three_way_split_keeps_runs_together(self):
+        points = [(1, 0), (2, 0), (2, 1), (2, 2), (2, 3), (3, 0), (4, 0)]
+        left, loc, right = splitters.three_way_split(points, 0)
+
+        self.assertEqual(loc[0], 2)
+        self.assertEqual(sorted(len([x for x in side if x[0] == 2]) for side in (left, right)), [0, 3])
+        self.assertEqual(len(left) + len(right), len(points) - 1)
+
+    def test_duplicates_keep_trees_shallow(self):
+        duplicated = [x for x in map(tuple, np.round(generate_points(4000), 0))]
+        identical = [(1.0, 1.0)] * 2000
+
+        for splitter in (splitters.sliding_midpoint_split, splitters.three_way_split):
+            self.assertLessEqual(kdtree.create(duplicated, 2, splitter=splitter).height, 20)
+            self.assertLessEqual(kdtree.create(identical, 2, splitter=splitter).height, 12)
+
+    def test_widest_axis(self):
+        self.assertEqual(splitters.widest_axis([(0, 0), (1, 5), (2, 1)], 0), 1)
+
+    def test_leaf_buckets(self):
+        tree = kdtree.create(self.points, 2, leafsize=32)
+
+        self.assertLess(sum(1 for _ in tree.inorder()), len(self.points) // 10)
+        self.assertEqual(tree.size, len(self.points))
+        self.assertEqual(sorted(tree.points()), sorted(self.points))
+        self.check_nearest(tree, self.points)
+
+        for point in self.points[:1000]:
+            tree.remove(point)
+
+        self.assertEqual(sorted(tree.points()), sorted(self.points[1000:]))
+        self.check_nearest(tree, self.points[1000:])
+
+        with self.assertRaises(ValueError):
+            flat_kdtree.FlatTree.from_tree(tree, 2)
+
+    def test_rebuilds_keep_build_options(self):
+        tree = kdtree.create(self.points[:256], 2, leafsize=16, axis_selector=splitters.widest_axis)
+
+        for point in self.points[256:456]:
+            tree.insert(point)
+
+        # inserted points become leaves of their own, but every rebuilt
+        # subtree is bucketed again
+        self.assertLess(sum(1 for _ in tree.inorder()), 200)
+        self.assertEqual(tree.build_options['leafsize'], 16)
+        self.assertEqual(tree.rebalance().build_options['axis_selector'], splitters.widest_axis)
+        self.assertEqual(sorted(tree.points()), sorted(self.points[:456]))
+        self.check_nearest(tree, self.points[:456])
+
+
+class TestQueryCache(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(5)
+        self.points = [x for x in map(tuple, generate_points(300))]
+
+    def test_hits_and_eviction(self):
+        tree = query_cache.CachedTree(flat_kdtree.create(self.points), maxsize=2)
+
+        first = tree.radius_query((2, 2), 0.5)
+        self.assertIs(tree.radius_query((2.0, 2.0), 0.5), first)
+        tree.range_query((0, 0), (1, 1), count_only=True)
+        tree.nearest((1, 1), 3)
+
+        self.assertEqual(tree.cache_info(), (1, 3, 2, 2))
+
+        tree.radius_query((2, 2), 0.5)
+        self.assertEqual(tree.misses, 4)
+
+    def test_invalidation(self):
+        tree = query_cache.CachedTree(kdtree.create(self.points, 2))
+
+        self.assertNotEqual(tree.nearest((-1, -1))[1], [(-1, -1)])
+
+        tree.insert((-1, -1))
+        self.assertEqual(tree.nearest((-1, -1))[1], [(-1, -1)])
+
+        tree.remove((-1, -1))
+        self.assertNotEqual(tree.nearest((-1, -1))[1], [(-1, -1)])
+
+        tree.rebalance()
+        self.assertEqual(tree.cache_info().currsize, 0)
+        self.assertEqual(tree.hits, 0)
+        self.assertEqual(tree.size, len(self.points))
+
+    def test_region_queries_need_flat_tree(self):
+        tree = query_cache.CachedTree(kdtree.create(self.points, 2))
+
+        with self.assertRaises(TypeError):
+            tree.range_query((0, 0), (1, 1))
+
+        with self.assertRaises(TypeError):
+            tree.radius_query((0, 0), 1)
+
+        self.assertEqual(tree.cache_info().misses, 0)
+
+
+class TestDualTree(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(9)
+        self.first = np.round(generate_points(700), 1)
+        self.second = generate_points(500)
+
+    def test_knn_join(self):
+        distances, indices = dual_tree.knn_join(flat_kdtree.create(self.first),
+                                                flat_kdtree.create(self.second), k=3)
+
+        expected = np.sqrt(((self.first[:, None] - self.second[None]) ** 2).sum(axis=2))
+        expected.sort(axis=1)
+
+        self.assertTrue(np.allclose(distances, expected[:, :3]))
+        self.assertTrue(np.allclose(np.linalg.norm(self.first[:, None] - self.second[indices], axis=2), distances))
+
+    def test_knn_join_node_trees(self):
+        points = [x for x in map(tuple, self.second)]
+        distances, indices = dual_tree.knn_join(kdtree.create(points, 2), flat_kdtree.create(points[:2]), k=3)
+
+        self.assertEqual(distances.shape, (len(points), 3))
+        self.assertTrue(np.isinf(distances[:, 2]).all())
+        self.assertTrue((indices[:, 2] == flat_kdtree.EMPTY).all())
+
+    def test_radius_join(self):
+        first, second = dual_tree.radius_join(flat_kdtree.create(self.first), flat_kdtree.create(self.second), 0.3)
+        expected = np.nonzero(((self.first[:, None] - self.second[None]) ** 2).sum(axis=2) <= 0.09)
+
+        self.assertTrue(np.array_equal(first, expected[0]))
+        self.assertTrue(np.array_equal(second, expected[1]))
+
+    def test_radius_graph(self):
+        tree = flat_kdtree.create(self.first)
+        indptr, indices, distances = dual_tree.radius_graph(tree, 0.3)
+
+        expected = np.sqrt(((self.first[:, None] - self.first[None]) ** 2).sum(axis=2))
+        rows, columns = np.nonzero((expected <= 0.3) & ~np.eye(len(self.first), dtype=bool))
+
+        self.assertTrue(np.array_equal(indptr, np.searchsorted(rows, np.arange(len(self.first) + 1))))
+        self.assertTrue(np.array_equal(indices, columns))
+        self.assertTrue(np.allclose(distances, expected[rows, columns]))
+
+        covered = []
+
+        for rows, chunk_indptr, chunk_indices, _ in dual_tree.radius_graph(tree, 0.3, chunk_size=100):
+            covered.extend(rows)
+
+            for row, first, last in zip(rows, chunk_indptr[:-1], chunk_indptr[1:]):
+                self.assertTrue(np.array_equal(chunk_indices[first:last], indices[indptr[row]:indptr[row + 1]]))
+
+        self.assertEqual(sorted(covered), list(range(len(self.first))))
+
+        with_self = dual_tree.radius_graph(kdtree.create([x for x in map(tuple, self.first)], 2), 0.3,
+                                           include_self=True)
+        self.assertEqual(with_self[0][-1], indptr[-1] + len(self.first))
+
+
+class TestRender(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(8)
+        self.tree = flat_kdtree.create(generate_points(5000))
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_level_of_detail(self):
+        scale = np.array([100, 100]) / (self.tree.bounds[1] - self.tree.bounds[0])
+
+        segments, depths = render.split_segments(self.tree, scale, min_cell_pixels=0)
+        self.assertEqual(len(segments), len(self.tree))
+
+        segments, depths = render.split_segments(self.tree, scale, max_depth=3)
+        self.assertEqual(depths.tolist(), [0, 1, 1, 2, 2, 2, 2])
+        self.assertTrue((segments[0, :, 0] == segments[0, 0, 0]).all())
+
+        self.assertLess(len(render.split_segments(self.tree, scale, min_cell_pixels=4)[0]), 1000)
+
+    def test_render_files(self):
+        for name in ('tree.png', 'tree.svg'):
+            path = os.path.join(self.directory, name)
+            render.render_tree(self.tree, path, size=(300, 200), max_depth=8)
+
+            self.assertGreater(os.path.getsize(path), 0)
+
+        render.render_tree(kdtree.create([x for x in map(tuple, generate_points(100))], 2),
+                           os.path.join(self.directory, 'node.png'), size=(100, 100))
+
+        with self.assertRaises(ValueError):
+            render.render_tree(flat_kdtree.create(np.random.rand(10, 3)),
+                               os.path.join(self.directory, 'tree3d.png'))
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(instrumentation.active)
+
+    def test_collect(self):
+        points = [tuple(x) for x in generate_points(500)]
+
+        with instrumentation.collect() as stats:
+            tree = kdtree.create(points, 2)
+            tree.nearest((1, 1), 3)
+            prune_tree(transform_tree(tree))
+
+        self.assertIsNone(instrumentation.active)
+        self.assertEqual(stats.counters['splits'], 500)
+        self.assertGreater(stats.points_per_split, 1)
+        self.assertGreater(stats.counters['nodes_visited'], 500)
+        self.assertGreater(stats.counters['distance_evaluations'], 0)
+
+        for phase in ('split', 'recurse', 'transform', 'prune'):
+            self.assertGreater(stats.times[phase], 0)
+
+    def test_enable(self):
+        tree = flat_kdtree.create(generate_points(500))
+        stats = instrumentation.enable()
+
+        try:
+            tree.radius_query((2, 2), 0.5)
+            tree.query_batch(generate_points(10), 2)
+        finally:
+            self.assertIs(instrumentation.disable(), stats)
+
+        self.assertGreater(stats.counters['nodes_visited'], 0)
+        self.assertGreater(stats.counters['comparisons'], 0)
+
+
+class TestFlatTree(unittest.TestCase):
+
+    def test_same_shape_as_node_tree(self):
+        np.random.seed(7)
+        points = [x for x in map(tuple, generate_points(2000))]
+
+        node_tree = kdtree.create(points, 2)
+        flat_tree = flat_kdtree.create(points, 2)
+
+        self.assertEqual([x.data for x in node_tree.level_order()],
+                         [x.data for x in flat_tree.level_order()])
+        self.assertEqual([x.data for x in node_tree.inorder()],
+                         [x.data for x in flat_tree.inorder()])
+        self.assertEqual(node_tree.height, flat_tree.height)
+
+    def test_duplicate_coordinates_split(self):
+        np.random.seed(7)
+        tree = flat_kdtree.create(np.random.randint(0, 3, (500, 2)).astype('double'))
+
+        self.assertEqual(sorted(tree.indices.tolist()), list(range(500)))
+
+        for node in tree.level_order():
+            i = node.index
+            split = tree.points[tree.pivot[i], node.axis]
+
+            self.assertTrue((tree.points[tree.start[i]:tree.pivot[i], node.axis] <= split).all())
+            self.assertTrue((tree.points[tree.pivot[i] + 1:tree.end[i], node.axis] >= split).all())
+
+    def test_visualization_tree(self):
+        tree = flat_kdtree.create(get_test_points(), 2)
+
+        visualization_tree = visualization.create_visualization_tree(tree)
+
+        self.assertTrue(are_equal_trees(visualization_tree, load_test_tree()))
+
+    def test_layouts(self):
+        np.random.seed(21)
+        points = generate_points(1000)
+        queries = generate_points(200)
+        tree = flat_kdtree.create(points)
+
+        for layout in flat_kdtree.LAYOUTS:
+            relaid = flat_kdtree.create(points, layout=layout)
+
+            self.assertTrue(np.array_equal(relaid.locate(queries), tree.locate(queries)))
+            self.assertTrue(np.array_equal(relaid.query_batch(queries, 3)[1], tree.query_batch(queries, 3)[1]))
+            self.assertTrue(np.array_equal(relaid.nearest(queries[0], 3)[1], tree.nearest(queries[0], 3)[1]))
+            self.assertEqual([x.data for x in relaid.level_order()], [x.data for x in tree.level_order()])
+
+        # on a complete tree of four levels the van Emde Boas order stores
+        # the top two levels, then each subtree of two levels below them
+        complete = flat_kdtree.create(points[:15])
+        relaid = complete.relayout('veb')
+        levels = dict((position, i) for i, position in enumerate(complete.pivot.tolist()))
+
+        self.assertEqual([levels[x] for x in relaid.pivot.tolist()],
+                         [0, 1, 2, 3, 7, 8, 4, 9, 10, 5, 11, 12, 6, 13, 14])
+
+        with self.assertRaises(ValueError):
+            tree.relayout('spiral')
+
+    def test_from_tree(self):
+        node_tree = kdtree.create(get_test_points(), 2)
+        flat_tree = flat_kdtree.FlatTree.from_tree(node_tree, 2)
+
+        self.assertEqual([x.data for x in node_tree.level_order()],
+                         [x.data for x in flat_tree.level_order()])
+
+
+def query_in_worker(task):
+    method, source, queries = task
+    tree = getattr(storage, method)(source)
+
+    return tree.query_batch(queries, 3)[1].tolist()
+
+
 def generate_points(points_count):
     size = (points_count, 2)
     return np.random.uniform(0, 4, size)
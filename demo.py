@@ -9,39 +9,32 @@
 
 
 import numpy as np
+import time
+import tracemalloc
 
 from kdtree import create
+import flat_kdtree
 from visualization import visualize_2d_tree, visualize_2d_tree_by_levels
-from algorithms import tracing_convex_hull_points, prune_tree, transform_tree
+from algorithms import trace_convex_hull, match_templates, hull_candidates
 from scipy.spatial import ConvexHull
 import matplotlib.pyplot as plt
 import pickle
 
-def check(points, templates):
-    counts = [0 for x in templates]
+def check(traced, templates):
+    points, on_hull, depths, bits = traced
 
-    for point in points:
-        belongs_to_convex_hull = point[1]
+    matched = match_templates(depths, bits, templates)
+    removed = matched != -1
 
-        idx = -1
+    if (removed & on_hull).any():
+        return False, 0
 
-        for i in range(len(templates)):
-            founded = point[3].find(templates[i]) != -1
-
-            if founded:
-                idx = i
-                counts[idx] += 1
-                break
-
-        if idx != -1 and belongs_to_convex_hull:
-            return False, 0
-
-    return True, counts
+    return True, np.bincount(matched[removed], minlength=len(templates)).tolist()
 
 
 def test():
     points_num = [1000, 2000, 5000, 10000, 20000, 25000]
-    templates = ['L R R R', 'R L L L', 'L L L L', 'R R R R']
+    templates = ['LRRR', 'RLLL', 'LLLL', 'RRRR']
 
     percents = []
 
@@ -50,36 +43,91 @@ def test():
 
         data = np.random.uniform(0, 4, size)
 
-        tree = create([x for x in map(tuple, data)], 2)
-
-        points = tracing_convex_hull_points(tree)
+        tree = flat_kdtree.create(data)
 
-        hull = ConvexHull(data)
-        hull_indices = [x for x in hull.vertices]
+        traced = trace_convex_hull(tree)
+        points, on_hull = traced[0], traced[1]
 
-        success, counts = check(points, templates)
+        success, counts = check(traced, templates)
 
         percent = sum(counts) / len(points) * 100
         percents.append(percent)
 
         print('========================')
         print("Points: " + str(num))
-        print("hull size " + str(hull_indices.__len__()))
+        print("hull size " + str(on_hull.sum()))
         print('success: ' + str(success))
         print("Summary removed: " + str(sum(counts)) + " from " + str(len(points)) + " (" + str(percent) + "%)")
 
     return points_num, percents
 
 
+def storage_benchmark():
+    points_num = [10000, 100000, 1000000]
+
+    for num in points_num:
+        data = np.random.uniform(0, 4, (num, 2))
+
+        tracemalloc.start()
+        tree = create([x for x in map(tuple, data)], 2)
+        node_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        node_count = sum(1 for _ in tree.level_order())
+        node_time = time.perf_counter() - start
+
+        del tree
+
+        tracemalloc.start()
+        flat_tree = flat_kdtree.create(data)
+        flat_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        flat_count = sum(1 for _ in flat_tree.level_order())
+        flat_time = time.perf_counter() - start
+
+        assert node_count == flat_count
+
+        print('========================')
+        print("Points: " + str(num))
+        print("Node tree: %.1f bytes/point, level order %.3f s" % (node_bytes / num, node_time))
+        print("Flat tree: %.1f bytes/point, level order %.3f s" % (flat_bytes / num, flat_time))
+
+
 def convex_hull_test(data):
     ConvexHull(data)
 
 
-def convex_hull_with_pruning(data):
-    tree = create([x for x in map(tuple, data)], 2)
-    pruned_tree = prune_tree(tree)
+def convex_hull_with_pruning(tree):
+    return ConvexHull(hull_candidates(tree))
+
+
+def hull_benchmark():
+    points_num = [10000, 100000, 1000000]
 
-    ConvexHull([x.data for x in tree.level_order()])
+    for num in points_num:
+        data = np.random.uniform(0, 4, (num, 2))
+
+        start = time.perf_counter()
+        convex_hull_test(data)
+        raw_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        tree = flat_kdtree.create(data)
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        convex_hull_with_pruning(tree)
+        pruned_time = time.perf_counter() - start
+
+        print('========================')
+        print("Points: " + str(num))
+        print("ConvexHull on raw data: %.4f s" % raw_time)
+        print("ConvexHull on pruned tree: %.4f s (tree built beforehand)" % pruned_time)
+        print("Tree build: %.4f s" % build_time)
+        print("Build + pruned ConvexHull, end to end: %.4f s" % (build_time + pruned_time))
 
 
 if __name__ == '__main__':
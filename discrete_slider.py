@@ -1,3 +1,4 @@
+from matplotlib.transforms import Bbox
 from matplotlib.widgets import Slider
 
 class DiscreteSlider(Slider):
@@ -7,24 +8,56 @@ class DiscreteSlider(Slider):
         "increment" specifies the step size that the slider will be discritized
         to."""
         self.inc = kwargs.pop('increment', 1.0)
+        self._background = None
+        self._animated = []
         Slider.__init__(self, *args, **kwargs)
 
+        # the moving parts are animated: they are left out of regular draws
+        # and blitted over a saved background when the value changes
+        self._animated = [artist for artist in (self.poly, getattr(self, '_handle', None), self.valtext)
+                          if artist is not None]
+
+        for artist in self._animated:
+            artist.set_animated(True)
+
+        self.connect_event('draw_event', self._on_draw)
+
+    def _region(self):
+        # the value text is drawn to the right of the slider axes
+        bbox = self.ax.bbox
+        return Bbox.from_extents(bbox.x0, bbox.y0, self.ax.figure.bbox.x1, bbox.y1)
+
+    def _on_draw(self, event):
+        self._background = self.canvas.copy_from_bbox(self._region())
+        self._draw_animated()
+
+    def _draw_animated(self):
+        for artist in self._animated:
+            self.ax.draw_artist(artist)
+
     def set_val(self, val):
         discrete_val = int(val / self.inc) * self.inc
-        # We can't just call Slider.set_val(self, discrete_val), because this
-        # will prevent the slider from updating properly (it will get stuck at
-        # the first step and not "slide"). Instead, we'll keep track of the
-        # the continuous value as self.val and pass in the discrete value to
-        # everything else.
-        xy = self.poly.xy
-        xy[2] = discrete_val, 1
-        xy[3] = discrete_val, 0
-        self.poly.xy = xy
-        self.valtext.set_text(self.valfmt % discrete_val)
-        if self.drawon:
-            self.ax.figure.canvas.draw()
-        self.val = val
-        if not self.eventson:
+
+        if discrete_val == self.val and self._background is not None:
             return
-        for cid, func in self.observers.items():
-            func(discrete_val)
+
+        # Slider.set_val updates the bar and the text and notifies the
+        # observers; its redraw of the whole canvas is replaced by blitting
+        drawon = self.drawon
+        self.drawon = False
+
+        try:
+            Slider.set_val(self, discrete_val)
+        finally:
+            self.drawon = drawon
+
+        if not drawon:
+            return
+
+        if self._background is None or not self.canvas.supports_blit:
+            self.canvas.draw_idle()
+            return
+
+        self.canvas.restore_region(self._background)
+        self._draw_animated()
+        self.canvas.blit(self._region())
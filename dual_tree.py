@@ -0,0 +1,525 @@
+"""
+    File name: dual_tree.py
+    License: MIT
+    Author: Orlov Michael
+    Date created: 18.10.2026
+    Python Version: 3.5
+    Description: dual-tree k-NN and radius joins and radius graphs of kd-trees
+
+    Usage:
+        distances, indices = knn_join(flat_kdtree.create(queries), flat_kdtree.create(points), k=4)
+        first, second = radius_join(flat_kdtree.create(a), flat_kdtree.create(b), 0.1)
+        indptr, indices, distances = radius_graph(flat_kdtree.create(points), 0.1)
+"""
+
+
+import numpy as np
+import instrumentation
+from flat_kdtree import FlatTree, EMPTY, merge_best
+
+
+# query subtrees with at most this many points are matched as one block
+QUERY_LEAF_SIZE = 16
+
+# reference subtrees with at most this many points are scanned whole
+REFERENCE_LEAF_SIZE = 16
+
+# block pairs scanned with one distance computation
+PAIRS_CHUNK = 2048
+
+
+def as_flat(tree):
+    """
+    Returns tree as a FlatTree
+
+    A kdtree.Node tree is converted with FlatTree.from_tree, so its points
+    are indexed in inorder.
+    """
+
+    if isinstance(tree, FlatTree):
+        return tree
+
+    return FlatTree.from_tree(tree, len(tree.data) if tree else 1)
+
+
+class _Blocks(object):
+    """
+    The query side of a join: a partition of the points of a tree into
+    contiguous slices with their boxes
+
+    Subtrees of at most QUERY_LEAF_SIZE points are blocks; the pivot of every
+    larger subtree is a block of its own. Blocks are ordered by position, so
+    per-point values reduce to per-block ones with one reduceat.
+    """
+
+    def __init__(self, tree):
+        node_mins, node_maxs = tree.node_bounds()
+        size = tree.end - tree.start
+
+        lo = []
+        hi = []
+        mins = []
+        maxs = []
+
+        nodes = np.array([tree.root] if tree else [], dtype=np.intp)
+
+        while len(nodes):
+            leaves = nodes[size[nodes] <= QUERY_LEAF_SIZE]
+            inner = nodes[size[nodes] > QUERY_LEAF_SIZE]
+            pivots = tree.pivot[inner]
+
+            lo.extend((tree.start[leaves], pivots))
+            hi.extend((tree.end[leaves], pivots + 1))
+            mins.extend((node_mins[leaves], tree.points[pivots]))
+            maxs.extend((node_maxs[leaves], tree.points[pivots]))
+
+            children = np.concatenate((tree.children_left[inner], tree.children_right[inner]))
+            nodes = children[children != EMPTY]
+
+        if not lo:
+            lo = hi = [np.empty(0, dtype=np.intp)]
+            mins = maxs = [np.empty((0, tree.dimension))]
+
+        lo = np.concatenate(lo)
+        order = np.argsort(lo)
+
+        self.lo = lo[order]
+        self.hi = np.concatenate(hi)[order]
+        self.mins = np.concatenate(mins)[order]
+        self.maxs = np.concatenate(maxs)[order]
+
+    def __len__(self):
+        return len(self.lo)
+
+    def reduce_max(self, values):
+        return np.maximum.reduceat(values, self.lo) if len(self.lo) else values[:0]
+
+
+class _Reference(object):
+    """
+    The reference side of a join: the subtrees of a tree plus the pivot of
+    every node as a single-point subtree
+
+    Subtree i keeps id i and the pivot at position p gets id nodes + p, so
+    box, slice and leaf lookups are single gathers. A node is split into its
+    left subtree, its pivot and its right subtree.
+    """
+
+    def __init__(self, tree):
+        node_mins, node_maxs = tree.node_bounds()
+        positions = np.arange(len(tree))
+
+        self.tree = tree
+        self.nodes = len(tree.pivot)
+        self.mins = np.concatenate((node_mins, tree.points))
+        self.maxs = np.concatenate((node_maxs, tree.points))
+        self.start = np.concatenate((tree.start, positions))
+        self.end = np.concatenate((tree.end, positions + 1))
+        self.leaf = self.end - self.start <= REFERENCE_LEAF_SIZE
+
+    def split(self, blocks, ids):
+        """
+        Returns the (blocks, ids) pairs replacing the given ones when the
+        reference side is split
+        """
+
+        pivots = self.nodes + self.tree.pivot[ids]
+        left = self.tree.children_left[ids]
+        right = self.tree.children_right[ids]
+
+        blocks = np.concatenate((blocks, blocks, blocks))
+        ids = np.concatenate((left, pivots, right))
+        kept = ids != EMPTY
+
+        return blocks[kept], ids[kept]
+
+    def home(self, centers):
+        """
+        Returns for every center the smallest subtree of more than
+        REFERENCE_LEAF_SIZE points or the leaf its descent ends in
+        """
+
+        tree = self.tree
+        ids = np.full(len(centers), tree.root, dtype=np.intp)
+        descending = np.arange(len(centers))
+
+        while len(descending):
+            descending = descending[~self.leaf[ids[descending]]]
+            nodes = ids[descending]
+
+            diff = centers[descending, tree.split_axis[nodes]] - tree.points[tree.pivot[nodes], tree.split_axis[nodes]]
+            near = np.where(diff < 0, tree.children_left[nodes], tree.children_right[nodes])
+            far = np.where(diff < 0, tree.children_right[nodes], tree.children_left[nodes])
+            near = np.where(near == EMPTY, far, near)
+
+            descending = descending[near != EMPTY]
+            ids[descending] = near[near != EMPTY]
+
+        return ids
+
+
+def _box_distances(lo_a, hi_a, lo_b, hi_b):
+    """
+    Returns the smallest and largest squared distances between points of
+    pairs of boxes
+    """
+
+    gaps = np.maximum(np.maximum(lo_a - hi_b, lo_b - hi_a), 0)
+    spans = np.maximum(hi_a - lo_b, hi_b - lo_a)
+
+    return (gaps ** 2).sum(axis=1), (spans ** 2).sum(axis=1)
+
+
+def _scan(query, reference, lo, hi, start, end):
+    """
+    Returns the distances between the points of query slices lo..hi and of
+    reference slices start..end, pairwise
+
+    The result is (distances, query positions, reference positions, valid),
+    each of shape (pairs, query slice, reference slice), slices padded to the
+    longest one.
+    """
+
+    query_positions = lo[:, None] + np.arange((hi - lo).max())
+    reference_positions = start[:, None] + np.arange((end - start).max())
+    valid = (query_positions < hi[:, None])[:, :, None] & (reference_positions < end[:, None])[:, None, :]
+
+    query_positions = np.minimum(query_positions, len(query.points) - 1)
+    reference_positions = np.minimum(reference_positions, len(reference.points) - 1)
+
+    distances = ((query.points[query_positions][:, :, None, :] -
+                  reference.points[reference_positions][:, None, :, :]) ** 2).sum(axis=3)
+
+    query_positions, reference_positions = np.broadcast_arrays(query_positions[:, :, None],
+                                                               reference_positions[:, None, :])
+
+    return distances, query_positions, reference_positions, valid
+
+
+def knn_join(query_tree, reference_tree, k=1):
+    """
+    Returns the k nearest points of reference_tree for every point of
+    query_tree as arrays (distances, indices) of shape (n, k)
+
+    Row i belongs to the point with index i in query_tree, and indices are
+    into the points reference_tree was created from; both are inorder
+    positions for kdtree.Node trees. Missing neighbours, when
+    reference_tree has fewer than k points, are inf with index -1.
+
+    The query tree is cut into blocks of nearby points and all blocks walk
+    the reference tree together one level at a time. A pair of a block and
+    a reference subtree is dropped once their boxes are farther apart than
+    the k-th neighbour found so far of every point in the block, so each
+    block visits only the subtrees around it, as a single query would, and
+    pays for them once rather than once per point. Every block first scans
+    the leaf its center descends to, which gives tight bounds from the
+    start.
+    """
+
+    if k < 1:
+        raise ValueError('k must be at least 1')
+
+    query = as_flat(query_tree)
+    reference = as_flat(reference_tree)
+
+    n = len(query)
+    best_distances = np.full((n, k), np.inf)
+    best_positions = np.full((n, k), EMPTY, dtype=np.intp)
+
+    if not n or not len(reference):
+        return np.sqrt(best_distances), best_positions
+
+    if query.dimension != reference.dimension:
+        raise ValueError('trees of different dimensions cannot be joined')
+
+    blocks = _Blocks(query)
+    side = _Reference(reference)
+    counts = [0, 0]
+
+    def scan(pairs_blocks, pairs_ids):
+        for first in range(0, len(pairs_blocks), PAIRS_CHUNK):
+            chunk = pairs_blocks[first:first + PAIRS_CHUNK]
+            ids = pairs_ids[first:first + PAIRS_CHUNK]
+
+            distances, owners, positions, valid = _scan(query, reference, blocks.lo[chunk], blocks.hi[chunk],
+                                                        side.start[ids], side.end[ids])
+            counts[1] += int(valid.sum())
+
+            # only the k closest points of a reference slice can enter the
+            # neighbours of a query point, so the rest are not merged
+            distances = np.where(valid, distances, np.inf)
+
+            if distances.shape[2] > k:
+                closest = np.argpartition(distances, k - 1, axis=2)[:, :, :k]
+                distances = np.take_along_axis(distances, closest, axis=2)
+                owners = owners[:, :, :k]
+                positions = np.take_along_axis(positions, closest, axis=2)
+
+            valid = distances < best_distances[owners, -1]
+
+            merge_best(best_distances, best_positions, owners[valid], distances[valid], positions[valid])
+
+    home = side.home((blocks.mins + blocks.maxs) / 2)
+    scan(np.arange(len(blocks)), home)
+
+    pairs_blocks = np.arange(len(blocks))
+    pairs_ids = np.full(len(blocks), reference.root, dtype=np.intp)
+
+    while len(pairs_blocks):
+        counts[0] += len(pairs_blocks)
+
+        bounds = blocks.reduce_max(best_distances[:, -1])
+        near, _ = _box_distances(blocks.mins[pairs_blocks], blocks.maxs[pairs_blocks],
+                                 side.mins[pairs_ids], side.maxs[pairs_ids])
+
+        kept = (near < bounds[pairs_blocks]) & (pairs_ids != home[pairs_blocks])
+        pairs_blocks = pairs_blocks[kept]
+        pairs_ids = pairs_ids[kept]
+
+        leaves = side.leaf[pairs_ids]
+        scan(pairs_blocks[leaves], pairs_ids[leaves])
+
+        pairs_blocks, pairs_ids = side.split(pairs_blocks[~leaves], pairs_ids[~leaves])
+
+    _record(counts)
+
+    distances = np.empty_like(best_distances)
+    indices = np.empty_like(best_positions)
+
+    distances[query.indices] = np.sqrt(best_distances)
+    indices[query.indices] = np.where(best_positions == EMPTY, EMPTY, reference.indices[best_positions])
+
+    return distances, indices
+
+
+def _radius_pairs(query, reference, blocks, side, block_ids, r2, counts, with_distances=True):
+    """
+    Yields batches (query positions, reference positions, squared
+    distances) of all pairs within sqrt(r2) between the points of the
+    given blocks and of the reference tree
+
+    Pairs of a block and a subtree are dropped when their boxes are farther
+    apart than the radius and taken whole when the boxes lie entirely within
+    it; distances of such pairs are computed only with_distances, otherwise
+    their batch carries None.
+    """
+
+    pairs_blocks = np.asarray(block_ids, dtype=np.intp)
+    pairs_ids = np.full(len(pairs_blocks), reference.root, dtype=np.intp)
+
+    while len(pairs_blocks):
+        counts[0] += len(pairs_blocks)
+
+        near, far = _box_distances(blocks.mins[pairs_blocks], blocks.maxs[pairs_blocks],
+                                   side.mins[pairs_ids], side.maxs[pairs_ids])
+
+        kept = near <= r2
+        inside = far[kept] <= r2
+        pairs_blocks = pairs_blocks[kept]
+        pairs_ids = pairs_ids[kept]
+
+        if inside.any():
+            # every point of the block is paired with every point of the subtree
+            lo = blocks.lo[pairs_blocks[inside]]
+            sizes = blocks.hi[pairs_blocks[inside]] - lo
+            start = side.start[pairs_ids[inside]]
+            widths = side.end[pairs_ids[inside]] - start
+
+            totals = sizes * widths
+            owners = np.repeat(np.arange(len(totals)), totals)
+            offsets = np.arange(totals.sum()) - np.repeat(np.cumsum(totals) - totals, totals)
+
+            query_positions = lo[owners] + offsets // widths[owners]
+            reference_positions = start[owners] + offsets % widths[owners]
+            distances = None
+
+            if with_distances:
+                distances = ((query.points[query_positions] - reference.points[reference_positions]) ** 2).sum(axis=1)
+
+            yield query_positions, reference_positions, distances
+
+        pairs_blocks = pairs_blocks[~inside]
+        pairs_ids = pairs_ids[~inside]
+        leaves = side.leaf[pairs_ids]
+
+        leaf_blocks = pairs_blocks[leaves]
+        leaf_ids = pairs_ids[leaves]
+
+        for first in range(0, len(leaf_blocks), PAIRS_CHUNK):
+            chunk = leaf_blocks[first:first + PAIRS_CHUNK]
+            ids = leaf_ids[first:first + PAIRS_CHUNK]
+
+            distances, owners, positions, valid = _scan(query, reference, blocks.lo[chunk], blocks.hi[chunk],
+                                                        side.start[ids], side.end[ids])
+            counts[1] += int(valid.sum())
+            valid &= distances <= r2
+
+            yield owners[valid], positions[valid], distances[valid]
+
+        pairs_blocks, pairs_ids = side.split(pairs_blocks[~leaves], pairs_ids[~leaves])
+
+
+def _record(counts):
+    stats = instrumentation.active
+
+    if stats is not None:
+        stats.counters['comparisons'] += counts[0]
+        stats.counters['distance_evaluations'] += counts[1]
+
+
+def radius_join(first_tree, second_tree, r):
+    """
+    Returns all pairs of points, one from each tree, within distance r of
+    each other as index arrays (first, second) sorted by first, then second
+
+    Indices are into the points each tree was created from; inorder
+    positions for kdtree.Node trees. Joining a tree with itself pairs
+    every point with itself too.
+
+    Pairs of a block of first_tree and a subtree of second_tree are dropped
+    when their boxes are farther apart than r and taken whole, without a
+    single distance, when the boxes lie entirely within r of each other.
+    """
+
+    if r < 0:
+        raise ValueError('r must not be negative')
+
+    first = as_flat(first_tree)
+    second = as_flat(second_tree)
+
+    if not len(first) or not len(second):
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+
+    if first.dimension != second.dimension:
+        raise ValueError('trees of different dimensions cannot be joined')
+
+    blocks = _Blocks(first)
+    counts = [0, 0]
+
+    found_first = []
+    found_second = []
+
+    for first_positions, second_positions, _ in _radius_pairs(first, second, blocks, _Reference(second),
+                                                              np.arange(len(blocks)), float(r) ** 2, counts,
+                                                              with_distances=False):
+        found_first.append(first_positions)
+        found_second.append(second_positions)
+
+    _record(counts)
+
+    first_indices = first.indices[np.concatenate(found_first)] if found_first else np.empty(0, dtype=np.intp)
+    second_indices = second.indices[np.concatenate(found_second)] if found_second else np.empty(0, dtype=np.intp)
+    order = np.lexsort((second_indices, first_indices))
+
+    return first_indices[order], second_indices[order]
+
+
+def radius_graph(tree, r, chunk_size=None, include_self=False):
+    """
+    Returns the graph joining every point of tree to the points within
+    distance r of it as CSR arrays (indptr, indices, distances)
+
+    Row i lists the neighbours of the point with index i in ascending
+    order of their indices, which are into the points tree was created
+    from; inorder positions for kdtree.Node trees. A point is its own
+    neighbour only with include_self.
+
+    The graph is found by joining the tree with itself twice, first
+    counting the neighbours of every point and then writing them into
+    buffers allocated once from the counts.
+
+    With chunk_size, a generator is returned instead, yielding the graph
+    in pieces (rows, indptr, indices, distances) of about chunk_size
+    spatially close points each: rows holds the indices of the points, in
+    no particular order, and the CSR arrays are over those rows. Only one
+    piece is held in memory at a time.
+    """
+
+    if r < 0:
+        raise ValueError('r must not be negative')
+
+    if chunk_size is not None and chunk_size < 1:
+        raise ValueError('chunk_size must be at least 1')
+
+    tree = as_flat(tree)
+    join = tree, _Blocks(tree), _Reference(tree), float(r) ** 2, include_self
+
+    if chunk_size is None:
+        return _radius_graph_piece(join, 0, len(tree), chunk=False)[1:]
+
+    return _radius_graph_pieces(join, chunk_size)
+
+
+def _radius_graph_pieces(join, chunk_size):
+    for first in range(0, len(join[0]), chunk_size):
+        yield _radius_graph_piece(join, first, first + chunk_size, chunk=True)
+
+
+def _radius_graph_piece(join, first, last, chunk):
+    """
+    Returns (rows, indptr, indices, distances) for the points of the
+    blocks starting at positions first..last
+
+    Rows are the points of those blocks, by position when chunk is set and
+    all points by index otherwise.
+    """
+
+    tree, blocks, side, r2, include_self = join
+    counts = [0, 0]
+
+    block_ids = np.arange(np.searchsorted(blocks.lo, first), np.searchsorted(blocks.lo, last))
+    lo = blocks.lo[block_ids[0]] if len(block_ids) else first
+    hi = blocks.hi[block_ids[-1]] if len(block_ids) else first
+
+    if chunk:
+        rows = tree.indices[lo:hi]
+
+        def row_of(positions):
+            return positions - lo
+    else:
+        rows = np.arange(len(tree))
+
+        def row_of(positions):
+            return tree.indices[positions]
+
+    def pairs(with_distances):
+        for query_positions, reference_positions, distances in _radius_pairs(tree, tree, blocks, side, block_ids,
+                                                                             r2, counts, with_distances):
+            if not include_self:
+                distinct = query_positions != reference_positions
+                query_positions = query_positions[distinct]
+                reference_positions = reference_positions[distinct]
+
+                if distances is not None:
+                    distances = distances[distinct]
+
+            yield row_of(query_positions), reference_positions, distances
+
+    indptr = np.zeros(len(rows) + 1, dtype=np.intp)
+
+    for owners, _, _ in pairs(with_distances=False):
+        indptr[1:] += np.bincount(owners, minlength=len(rows))
+
+    np.cumsum(indptr, out=indptr)
+
+    indices = np.empty(indptr[-1], dtype=np.intp)
+    distances = np.empty(indptr[-1])
+    filled = indptr[:-1].copy()
+
+    for owners, positions, squared in pairs(with_distances=True):
+        order = np.argsort(owners, kind='stable')
+        owners = owners[order]
+
+        slots = filled[owners] + np.arange(len(owners)) - np.searchsorted(owners, owners)
+        indices[slots] = tree.indices[positions[order]]
+        distances[slots] = squared[order]
+        filled += np.bincount(owners, minlength=len(rows))
+
+    _record(counts)
+
+    # sort every row by neighbour index
+    order = np.lexsort((indices, np.repeat(np.arange(len(rows)), np.diff(indptr))))
+    indices[:] = indices[order]
+    distances[:] = np.sqrt(distances[order])
+
+    return rows, indptr, indices, distances
@@ -0,0 +1,1061 @@
+"""
+    File name: flat_kdtree.py
+    License: MIT
+    Author: Orlov Michael
+    Date created: 18.10.2026
+    Python Version: 3.5
+    Description: array-backed kd-tree with contiguous coordinate storage
+"""
+
+
+from collections import deque
+import heapq
+import time
+import numpy as np
+import instrumentation
+
+
+EMPTY = -1
+
+# subtrees with at most this many points are scanned with one vectorized
+# distance computation instead of being descended node by node
+BRUTE_FORCE_SIZE = 16
+
+# the same for region queries, whose per-point test is cheaper
+REGION_BRUTE_FORCE_SIZE = 128
+
+LAYOUTS = ('level', 'veb', 'blocked')
+
+# levels per block of the blocked layout: 15 nodes, so every node array of
+# a block spans two 64-byte cache lines at most
+BLOCK_HEIGHT = 4
+
+
+class FlatNode(object):
+    """
+    A view of a single node of a FlatTree
+
+    Exposes the same surface as kdtree.Node (data, left, right, children,
+    inorder, level_order, height), so code written for kdtree.Node accepts
+    flat trees as well. Views are created on demand and hold no data.
+    """
+
+    __slots__ = ('tree', 'index')
+
+    def __init__(self, tree, index=EMPTY):
+        self.tree = tree
+        self.index = index
+
+    def __repr__(self):
+        return '<%(cls)s - %(data)s>' % \
+               dict(cls=self.__class__.__name__, data=repr(self.data))
+
+    def __nonzero__(self):
+        return self.index != EMPTY
+
+    __bool__ = __nonzero__
+
+    @property
+    def data(self):
+        if self.index == EMPTY:
+            return None
+
+        return tuple(self.tree.points[self.tree.pivot[self.index]].tolist())
+
+    @property
+    def axis(self):
+        return int(self.tree.split_axis[self.index])
+
+    @property
+    def left(self):
+        if self.index == EMPTY:
+            return None
+
+        return FlatNode(self.tree, int(self.tree.children_left[self.index]))
+
+    @property
+    def right(self):
+        if self.index == EMPTY:
+            return None
+
+        return FlatNode(self.tree, int(self.tree.children_right[self.index]))
+
+    @property
+    def size(self):
+        """
+        Returns the number of points in the (sub)tree
+        """
+
+        if self.index == EMPTY:
+            return 0
+
+        return int(self.tree.end[self.index] - self.tree.start[self.index])
+
+    @property
+    def is_leaf(self):
+        return self.index == EMPTY or \
+            (self.tree.children_left[self.index] == EMPTY and self.tree.children_right[self.index] == EMPTY)
+
+    @property
+    def children(self):
+        """
+        Returns an iterator for the non-empty children of the node as
+        (FlatNode, pos) tuples, where pos is 0 for the left subnode and 1 for
+        the right.
+        """
+
+        if self.index == EMPTY:
+            return
+
+        if self.tree.children_left[self.index] != EMPTY:
+            yield self.left, 0
+
+        if self.tree.children_right[self.index] != EMPTY:
+            yield self.right, 1
+
+    @property
+    def height(self):
+        """
+        Returns height of the (sub)tree, without considering empty leaf-nodes
+        """
+
+        if self.index == EMPTY:
+            return 0
+
+        if self.index == self.tree.root:
+            return self.tree.height
+
+        height = 0
+        level = [self.index]
+
+        while level:
+            height += 1
+            level = [c for i in level
+                     for c in (self.tree.children_left[i], self.tree.children_right[i])
+                     if c != EMPTY]
+
+        return height
+
+    def inorder(self):
+        """ iterator for nodes: left, root, right """
+
+        left = self.tree.children_left
+        right = self.tree.children_right
+
+        stack = []
+        index = self.index
+
+        while stack or index != EMPTY:
+            if index != EMPTY:
+                stack.append(index)
+                index = left[index]
+            else:
+                index = stack.pop()
+                yield FlatNode(self.tree, int(index))
+                index = right[index]
+
+    def level_order(self):
+        """
+        Returns an iterator over the tree in level-order
+        """
+
+        if self.index == EMPTY:
+            return
+
+        left = self.tree.children_left
+        right = self.tree.children_right
+
+        nodes_deque = deque()
+        nodes_deque.append(self.index)
+
+        while nodes_deque:
+            index = nodes_deque.popleft()
+
+            yield FlatNode(self.tree, int(index))
+
+            if left[index] != EMPTY:
+                nodes_deque.append(left[index])
+
+            if right[index] != EMPTY:
+                nodes_deque.append(right[index])
+
+
+class FlatTree(object):
+    """
+    A kd-tree stored in flat NumPy arrays
+
+    Coordinates live in one contiguous (n, k) array ordered so that every
+    subtree covers the contiguous slice points[start:end]. Per-node split
+    axis, child links and the position of the node's own point are kept in
+    parallel integer arrays; EMPTY marks a missing child.
+
+    The tree itself behaves like its root node, so it can be passed
+    wherever a kdtree.Node is expected.
+    """
+
+    def __init__(self, points, indices, pivot, split_axis, children_left, children_right,
+                 start, end, height, root=0):
+        self.points = points
+        self.indices = indices
+        self.pivot = pivot
+        self.split_axis = split_axis
+        self.children_left = children_left
+        self.children_right = children_right
+        self.start = start
+        self.end = end
+        self.height = height
+        self.root = root if len(pivot) else EMPTY
+        self._bounds = None
+        self._node_bounds = None
+
+    def __repr__(self):
+        return '<%(cls)s - %(n)d points, %(k)d dimensions>' % \
+               dict(cls=self.__class__.__name__, n=len(self), k=self.dimension)
+
+    def __len__(self):
+        return len(self.points)
+
+    def __nonzero__(self):
+        return self.root != EMPTY
+
+    __bool__ = __nonzero__
+
+    @property
+    def dimension(self):
+        return self.points.shape[1]
+
+    @property
+    def nbytes(self):
+        """
+        Returns the number of bytes held by the tree arrays
+        """
+
+        return sum(a.nbytes for a in (self.points, self.indices, self.pivot, self.split_axis,
+                                      self.children_left, self.children_right,
+                                      self.start, self.end))
+
+    @property
+    def root_node(self):
+        return FlatNode(self, self.root)
+
+    @property
+    def data(self):
+        return self.root_node.data
+
+    @property
+    def left(self):
+        return self.root_node.left
+
+    @property
+    def right(self):
+        return self.root_node.right
+
+    @property
+    def is_leaf(self):
+        return self.root_node.is_leaf
+
+    @property
+    def children(self):
+        return self.root_node.children
+
+    def inorder(self):
+        return self.root_node.inorder()
+
+    def level_order(self):
+        return self.root_node.level_order()
+
+    def nearest(self, point, k=1, eps=0, max_leaves=None):
+        """
+        Returns the k points of the tree nearest to point
+
+        The result is a pair of arrays (distances, indices) ordered by
+        increasing euclidean distance; indices refer to the points the tree
+        was created from. Subtrees lying farther from point than the current
+        k-th neighbour across the split plane of their parent are skipped,
+        and small subtrees are scanned in one vectorized step.
+
+        Eps and max_leaves make the search approximate as in
+        kdtree.Node.nearest; the vectorized scans count as leaves.
+        """
+
+        if k < 1:
+            raise ValueError('k must be positive')
+
+        if eps < 0:
+            raise ValueError('eps must not be negative')
+
+        if max_leaves is not None and max_leaves < 1:
+            raise ValueError('max_leaves must be positive')
+
+        factor = (1 + eps) ** 2
+
+        point = np.asarray(point, dtype=np.float64)
+
+        points = self.points
+        left = self.children_left
+        right = self.children_right
+
+        heap = []
+        stack = [(self.root, 0.0)] if self else []
+
+        popped = 0
+        visited = 0
+        leaves = 0
+        evaluated = 0
+
+        while stack:
+            node, plane_distance = stack.pop()
+            popped += 1
+
+            if len(heap) == k and plane_distance * factor >= -heap[0][0]:
+                continue
+
+            visited += 1
+            lo = self.start[node]
+            hi = self.end[node]
+
+            if hi - lo <= BRUTE_FORCE_SIZE:
+                evaluated += hi - lo
+                distances = ((points[lo:hi] - point) ** 2).sum(axis=1)
+
+                for position in np.argsort(distances)[:k]:
+                    distance = distances[position]
+
+                    if len(heap) < k:
+                        heapq.heappush(heap, (-distance, lo + position))
+                    elif distance < -heap[0][0]:
+                        heapq.heapreplace(heap, (-distance, lo + position))
+                    else:
+                        break
+
+                leaves += 1
+
+                if max_leaves is not None and leaves >= max_leaves:
+                    break
+
+                continue
+
+            position = self.pivot[node]
+            axis = self.split_axis[node]
+            evaluated += 1
+            distance = ((points[position] - point) ** 2).sum()
+
+            if len(heap) < k:
+                heapq.heappush(heap, (-distance, position))
+            elif distance < -heap[0][0]:
+                heapq.heapreplace(heap, (-distance, position))
+
+            diff = point[axis] - points[position, axis]
+
+            if diff < 0:
+                near, far = left[node], right[node]
+            else:
+                near, far = right[node], left[node]
+
+            if far != EMPTY:
+                stack.append((far, diff * diff))
+
+            if near != EMPTY:
+                stack.append((near, 0.0))
+
+        stats = instrumentation.active
+
+        if stats is not None:
+            stats.counters['nodes_visited'] += visited
+            stats.counters['leaves_visited'] += leaves
+            stats.counters['comparisons'] += popped
+            stats.counters['distance_evaluations'] += int(evaluated)
+
+        heap.sort(reverse=True)
+
+        distances = np.sqrt([-d for d, _ in heap])
+        indices = self.indices[np.array([p for _, p in heap], dtype=np.intp)]
+
+        return distances, indices
+
+    def query_batch(self, queries, k=1):
+        """
+        Returns the k nearest neighbours of every row of an (m, d) array
+
+        The whole block walks the tree together. First every query descends
+        to the bucket containing it, which gives tight initial bounds; then
+        the (query, node) pairs that may still hold closer points are
+        expanded level by level, with distances for all pairs of a level
+        computed in one NumPy step. Returns (distances, indices) arrays of
+        shape (m, k) ordered by increasing distance; when the tree holds
+        fewer than k points the missing entries are inf and -1.
+        """
+
+        if k < 1:
+            raise ValueError('k must be positive')
+
+        queries = np.asarray(queries, dtype=np.float64).reshape(-1, self.dimension)
+        m = len(queries)
+
+        best_distances = np.full((m, k), np.inf)
+        best_positions = np.full((m, k), EMPTY, dtype=np.intp)
+
+        if not self or not m:
+            return best_distances, best_positions
+
+        bucket_size = max(BRUTE_FORCE_SIZE, 2 * k)
+        size = self.end - self.start
+
+        # visited (query, node) pairs, split plane comparisons and distances
+        counts = [0, 0, 0]
+
+        def merge(owners, distances, positions):
+            merge_best(best_distances, best_positions, owners, distances, positions)
+
+        def scan_buckets(owners, nodes):
+            columns = np.arange(int(size[nodes].max()))
+            positions = self.start[nodes][:, None] + columns
+            valid = columns < size[nodes][:, None]
+            positions = np.where(valid, positions, 0)
+
+            distances = ((self.points[positions] - queries[owners][:, None, :]) ** 2).sum(axis=2)
+            distances[~valid] = np.inf
+
+            counts[0] += len(nodes)
+            counts[2] += int(size[nodes].sum())
+
+            return distances, positions, valid
+
+        home = np.full(m, self.root, dtype=np.intp)
+        descending = np.arange(m)
+
+        while True:
+            descending = descending[size[home[descending]] > bucket_size]
+
+            if not len(descending):
+                break
+
+            nodes = home[descending]
+            axes = self.split_axis[nodes]
+
+            counts[0] += len(nodes)
+            counts[1] += len(nodes)
+
+            diff = queries[descending, axes] - self.points[self.pivot[nodes], axes]
+            home[descending] = np.where(diff < 0, self.children_left[nodes], self.children_right[nodes])
+
+        distances, positions, valid = scan_buckets(np.arange(m), home)
+        ranks = np.argsort(distances, axis=1)[:, :k]
+
+        best_distances[:, :ranks.shape[1]] = np.take_along_axis(distances, ranks, axis=1)
+        best_positions[:, :ranks.shape[1]] = np.where(np.take_along_axis(valid, ranks, axis=1),
+                                                      np.take_along_axis(positions, ranks, axis=1), EMPTY)
+
+        owners = np.arange(m)
+        nodes = np.full(m, self.root, dtype=np.intp)
+        bounds = np.zeros(m)
+
+        while len(owners):
+            counts[1] += len(owners)
+
+            kept = (bounds < best_distances[owners, -1]) & (nodes != home[owners])
+            owners = owners[kept]
+            nodes = nodes[kept]
+            bounds = bounds[kept]
+
+            buckets = size[nodes] <= bucket_size
+
+            if buckets.any():
+                distances, positions, valid = scan_buckets(owners[buckets], nodes[buckets])
+                bucket_owners = np.broadcast_to(owners[buckets][:, None], valid.shape)
+                merge(bucket_owners[valid], distances[valid], positions[valid])
+
+            owners = owners[~buckets]
+            nodes = nodes[~buckets]
+            bounds = bounds[~buckets]
+
+            if not len(owners):
+                break
+
+            positions = self.pivot[nodes]
+            axes = self.split_axis[nodes]
+
+            counts[0] += len(nodes)
+            counts[2] += len(nodes)
+
+            merge(owners, ((self.points[positions] - queries[owners]) ** 2).sum(axis=1), positions)
+
+            diff = queries[owners, axes] - self.points[positions, axes]
+            near = np.where(diff < 0, self.children_left[nodes], self.children_right[nodes])
+            far = np.where(diff < 0, self.children_right[nodes], self.children_left[nodes])
+
+            owners = np.concatenate((owners, owners))
+            nodes = np.concatenate((near, far))
+            bounds = np.concatenate((bounds, np.maximum(bounds, diff * diff)))
+
+            kept = nodes != EMPTY
+            owners = owners[kept]
+            nodes = nodes[kept]
+            bounds = bounds[kept]
+
+        stats = instrumentation.active
+
+        if stats is not None:
+            stats.counters['nodes_visited'] += counts[0]
+            stats.counters['comparisons'] += counts[1]
+            stats.counters['distance_evaluations'] += counts[2]
+
+        indices = np.where(best_positions == EMPTY, EMPTY, self.indices[best_positions])
+
+        return np.sqrt(best_distances), indices
+
+    @property
+    def bounds(self):
+        """
+        Returns the (mins, maxs) corners of the box enclosing all points
+        """
+
+        if self._bounds is None:
+            self._bounds = self.points.min(axis=0), self.points.max(axis=0)
+
+        return self._bounds
+
+    def node_bounds(self):
+        """
+        Returns (mins, maxs) arrays of shape (nodes, k) with the box
+        enclosing the points of every subtree
+
+        Boxes are computed bottom-up one level at a time on first call and
+        cached.
+        """
+
+        if self._node_bounds is None:
+            mins = self.points[self.pivot].copy()
+            maxs = mins.copy()
+
+            levels = []
+            nodes = np.array([self.root] if self else [], dtype=np.intp)
+
+            while len(nodes):
+                levels.append(nodes)
+                children = np.concatenate((self.children_left[nodes], self.children_right[nodes]))
+                nodes = children[children != EMPTY]
+
+            for nodes in reversed(levels):
+                for children in (self.children_left[nodes], self.children_right[nodes]):
+                    has_child = children != EMPTY
+                    parents = nodes[has_child]
+                    children = children[has_child]
+
+                    mins[parents] = np.minimum(mins[parents], mins[children])
+                    maxs[parents] = np.maximum(maxs[parents], maxs[children])
+
+            self._node_bounds = mins, maxs
+
+        return self._node_bounds
+
+    def range_query(self, lo, hi, count_only=False):
+        """
+        Returns the points lying in the closed box lo <= x <= hi
+
+        The result is an array of indices into the points the tree was
+        created from, or their number when count_only is set. Subtrees whose
+        cell lies entirely inside the box are taken whole from their
+        subtree size without being visited.
+        """
+
+        lo = [float(x) for x in lo]
+        hi = [float(x) for x in hi]
+        box_lo = np.array(lo)
+        box_hi = np.array(hi)
+
+        def outside(cell_lo, cell_hi):
+            return any(c > b for c, b in zip(cell_lo, hi)) or any(c < b for c, b in zip(cell_hi, lo))
+
+        def inside(cell_lo, cell_hi):
+            return all(c >= b for c, b in zip(cell_lo, lo)) and all(c <= b for c, b in zip(cell_hi, hi))
+
+        def contains(points):
+            return ((points >= box_lo) & (points <= box_hi)).all(axis=1)
+
+        return self._search(outside, inside, contains, count_only)
+
+    def radius_query(self, center, r, count_only=False):
+        """
+        Returns the points lying within distance r of center
+
+        The result is an array of indices into the points the tree was
+        created from, or their number when count_only is set. Subtrees whose
+        cell lies entirely inside the ball are taken whole from their
+        subtree size without being visited.
+        """
+
+        center = [float(x) for x in center]
+        ball_center = np.array(center)
+        r2 = r * r
+
+        def outside(cell_lo, cell_hi):
+            return sum((c - min(max(c, a), b)) ** 2 for c, a, b in zip(center, cell_lo, cell_hi)) > r2
+
+        def inside(cell_lo, cell_hi):
+            return sum(max(c - a, b - c) ** 2 for c, a, b in zip(center, cell_lo, cell_hi)) <= r2
+
+        def contains(points):
+            return ((points - ball_center) ** 2).sum(axis=1) <= r2
+
+        return self._search(outside, inside, contains, count_only)
+
+    def _search(self, outside, inside, contains, count_only):
+        """
+        Walks the cells of the tree for a region query
+
+        The cell of a node is the box cut out of the root bounding box by
+        the split planes of its ancestors, as the x_lims/y_lims computed in
+        visualization.create_visualization_tree. Cells are kept as lists of
+        floats, which is cheaper than small arrays for the per-node tests.
+        In count_only mode only the counts are kept, so the walk takes memory
+        for the cells on its stack but none per matching point.
+        """
+
+        count = 0
+        found = []
+
+        points = self.points
+        start = self.start
+        end = self.end
+        pivot = self.pivot
+        split_axis = self.split_axis
+        left = self.children_left
+        right = self.children_right
+
+        stack = [(self.root,) + tuple(x.tolist() for x in self.bounds)] if self else []
+
+        visited = 0
+        tested = 0
+
+        while stack:
+            node, cell_lo, cell_hi = stack.pop()
+            visited += 1
+
+            if outside(cell_lo, cell_hi):
+                continue
+
+            lo = int(start[node])
+            hi = int(end[node])
+
+            if inside(cell_lo, cell_hi):
+                count += hi - lo
+
+                if not count_only:
+                    found.append(np.arange(lo, hi))
+                continue
+
+            if hi - lo <= REGION_BRUTE_FORCE_SIZE:
+                tested += hi - lo
+                mask = contains(points[lo:hi])
+                count += int(mask.sum())
+
+                if not count_only:
+                    found.append(lo + np.flatnonzero(mask))
+                continue
+
+            position = pivot[node]
+            axis = split_axis[node]
+            point = points[position].tolist()
+            split = point[axis]
+            tested += 1
+
+            if not outside(point, point):
+                count += 1
+
+                if not count_only:
+                    found.append(np.array([position]))
+
+            if left[node] != EMPTY:
+                child_hi = list(cell_hi)
+                child_hi[axis] = split
+                stack.append((left[node], cell_lo, child_hi))
+
+            if right[node] != EMPTY:
+                child_lo = list(cell_lo)
+                child_lo[axis] = split
+                stack.append((right[node], child_lo, cell_hi))
+
+        stats = instrumentation.active
+
+        if stats is not None:
+            stats.counters['nodes_visited'] += visited
+            stats.counters['comparisons'] += 2 * visited
+            stats.counters['distance_evaluations'] += tested
+
+        if count_only:
+            return count
+
+        if not found:
+            return np.empty(0, dtype=self.indices.dtype)
+
+        return self.indices[np.concatenate(found)]
+
+    def locate(self, queries):
+        """
+        Returns for every row of an (m, d) array the index of the point of
+        the last node on its descent from the root
+
+        That node is the leaf whose cell holds the query. All queries
+        descend together, one level per NumPy step.
+        """
+
+        queries = np.asarray(queries, dtype=np.float64).reshape(-1, self.dimension)
+        nodes = np.full(len(queries), self.root, dtype=np.intp)
+
+        if not self:
+            return nodes
+
+        active = np.arange(len(queries))
+        visited = 0
+
+        while len(active):
+            current = nodes[active]
+            visited += len(current)
+
+            axes = self.split_axis[current]
+            positions = self.pivot[current]
+            below = queries[active, axes] < self.points[positions, axes]
+
+            children = np.where(below, self.children_left[current], self.children_right[current])
+            descending = children != EMPTY
+
+            active = active[descending]
+            nodes[active] = children[descending]
+
+        instrumentation.count('nodes_visited', visited)
+
+        return self.indices[self.pivot[nodes]]
+
+    def relayout(self, layout='veb', block_height=BLOCK_HEIGHT):
+        """
+        Returns a tree with the same shape and points but its nodes
+        renumbered for locality of root-to-leaf descents
+
+        Level is the breadth-first order create builds. Veb is the van Emde
+        Boas order: the top half of the levels is stored first, then every
+        subtree hanging below it, each laid out the same way recursively,
+        so a descent touches O(log_B n) blocks of B nodes for any block
+        size B. Blocked stores subtrees of block_height levels contiguously,
+        every block in level order and followed by the blocks below it.
+        Points and indices are shared with this tree.
+        """
+
+        if layout not in LAYOUTS:
+            raise ValueError('layout must be one of %s' % ', '.join(LAYOUTS))
+
+        if block_height < 1:
+            raise ValueError('block_height must be positive')
+
+        if layout == 'level' or not self:
+            order = self._level_order_ids()
+        else:
+            order = self._layout_order(layout, block_height)
+
+        renumbered = np.empty(len(order), dtype=np.intp)
+        renumbered[order] = np.arange(len(order))
+
+        def link(children):
+            children = children[order]
+            return np.where(children == EMPTY, EMPTY, renumbered[children])
+
+        return FlatTree(self.points, self.indices, self.pivot[order], self.split_axis[order],
+                        link(self.children_left), link(self.children_right), self.start[order],
+                        self.end[order], self.height, int(renumbered[self.root]) if self else 0)
+
+    def _levels(self):
+        """
+        Returns the node ids of every level and the parent of every node
+        """
+
+        levels = []
+        parent = np.full(len(self.pivot), EMPTY, dtype=np.intp)
+        nodes = np.array([self.root] if self else [], dtype=np.intp)
+
+        while len(nodes):
+            levels.append(nodes)
+
+            for children in (self.children_left[nodes], self.children_right[nodes]):
+                parent[children[children != EMPTY]] = nodes[children != EMPTY]
+
+            children = np.stack((self.children_left[nodes], self.children_right[nodes]), axis=1).ravel()
+            nodes = children[children != EMPTY]
+
+        return levels, parent
+
+    def _level_order_ids(self):
+        levels, _ = self._levels()
+        return np.concatenate(levels) if levels else np.empty(0, dtype=np.intp)
+
+    def _layout_order(self, layout, block_height):
+        """
+        Returns the node ids in veb or blocked order
+
+        The levels are cut recursively into a top part and the subtrees
+        below it, until a part is a single level (veb) or at most
+        block_height levels (blocked), which is kept in level order. Every
+        cut adds one sort key: 0 above the cut, and below it one plus the
+        level-order rank of the ancestor on the first level below the cut,
+        which keeps each hanging subtree together. The nodes are then
+        sorted by their keys, cut by cut.
+        """
+
+        levels, parent = self._levels()
+        rank = np.empty(len(parent), dtype=np.intp)
+        rank[np.concatenate(levels)] = np.arange(len(parent))
+
+        # rules[cut][level]: ('top',), ('bottom', first level below the cut)
+        # or ('self',) once the part holding the level is not cut further
+        rules = []
+        parts = [(0, len(levels), 0)]
+
+        while parts:
+            lo, hi, cut = parts.pop()
+
+            if len(rules) <= cut:
+                rules.append({})
+
+            if hi - lo <= (1 if layout == 'veb' else block_height):
+                rules[cut].update((level, ('self',)) for level in range(lo, hi))
+                continue
+
+            middle = lo + (hi - lo) // 2 if layout == 'veb' else lo + block_height
+
+            rules[cut].update((level, ('top',)) for level in range(lo, middle))
+            rules[cut].update((level, ('bottom', middle)) for level in range(middle, hi))
+            parts.extend(((lo, middle, cut + 1), (middle, hi, cut + 1)))
+
+        keys = []
+
+        for rule in rules:
+            key = np.zeros(len(parent), dtype=np.intp)
+
+            for middle in sorted(set(r[1] for r in rule.values() if r[0] == 'bottom')):
+                # the ancestor of every node on level middle, pushed down
+                ancestor = np.empty(len(parent), dtype=np.intp)
+                ancestor[levels[middle]] = levels[middle]
+
+                for level in range(middle, len(levels)):
+                    nodes = levels[level]
+
+                    if level > middle:
+                        ancestor[nodes] = ancestor[parent[nodes]]
+
+                    if rule.get(level) == ('bottom', middle):
+                        key[nodes] = rank[ancestor[nodes]] + 1
+
+            for level, r in rule.items():
+                if r[0] == 'self':
+                    key[levels[level]] = rank[levels[level]] + 1
+
+            keys.append(key)
+
+        return np.lexsort(keys[::-1])
+
+    @classmethod
+    def from_tree(cls, tree, dimension):
+        """
+        Converts a kdtree.Node tree into a FlatTree with the same shape
+
+        The indices of the resulting tree are the inorder positions of the
+        source nodes. Trees with leaf buckets have no such shape and are
+        rejected with ValueError.
+        """
+
+        nodes = [] if not tree else [x for x in tree.level_order()]
+
+        if any(getattr(node, 'bucket', None) is not None for node in nodes):
+            raise ValueError('trees with leaf buckets cannot be converted')
+        ids = dict((id(node), i) for i, node in enumerate(nodes))
+        n = len(nodes)
+
+        points = np.empty((n, dimension), dtype=np.float64)
+        pivot = np.empty(n, dtype=np.intp)
+        axis = np.empty(n, dtype=np.int8)
+        left = np.full(n, EMPTY, dtype=np.intp)
+        right = np.full(n, EMPTY, dtype=np.intp)
+        start = np.empty(n, dtype=np.intp)
+        end = np.empty(n, dtype=np.intp)
+
+        for position, node in enumerate(tree.inorder() if n else []):
+            pivot[ids[id(node)]] = position
+            points[position] = node.data
+
+        depth = np.zeros(n, dtype=np.intp)
+
+        for i, node in enumerate(nodes):
+            axis[i] = node.axis
+
+            if node.left:
+                left[i] = ids[id(node.left)]
+                depth[left[i]] = depth[i] + 1
+
+            if node.right:
+                right[i] = ids[id(node.right)]
+                depth[right[i]] = depth[i] + 1
+
+        for i in range(n - 1, -1, -1):
+            start[i] = start[left[i]] if left[i] != EMPTY else pivot[i]
+            end[i] = end[right[i]] if right[i] != EMPTY else pivot[i] + 1
+
+        height = int(depth.max()) + 1 if n else 0
+
+        return cls(points, np.arange(n), pivot, axis, left, right, start, end, height)
+
+
+def merge_best(best_distances, best_positions, owners, distances, positions):
+    """
+    Merges candidate neighbours into (m, k) arrays of the best ones so far
+
+    Candidate i is the point at positions[i] with squared distance
+    distances[i] from query owners[i]; a query may own any number of
+    candidates. Candidates not closer than the current k-th neighbour of
+    their query are dropped first; the rest are merged with the current
+    rows of their queries by one lexsort over (query, distance).
+    """
+
+    k = best_distances.shape[1]
+    kept = distances < best_distances[owners, -1]
+
+    if not kept.any():
+        return
+
+    touched = np.unique(owners[kept])
+
+    owners = np.concatenate((np.repeat(touched, k), owners[kept]))
+    distances = np.concatenate((best_distances[touched].ravel(), distances[kept]))
+    positions = np.concatenate((best_positions[touched].ravel(), positions[kept]))
+
+    order = np.lexsort((distances, owners))
+    owners = owners[order]
+
+    rank = np.arange(len(owners)) - np.searchsorted(owners, owners)
+    kept = rank < k
+
+    best_distances[owners[kept], rank[kept]] = distances[order][kept]
+    best_positions[owners[kept], rank[kept]] = positions[order][kept]
+
+
+def select_medians(keys, order, lo, size):
+    """
+    Partitions the segments order[lo:lo + size] in place around their medians
+
+    All segments of one tree level are handled by a single vectorized
+    argpartition: they are padded to a common width (sizes on one level
+    differ by at most one) with the sentinel slot order[-1], whose key is
+    +inf, so the pad always sorts into the last column. Returns the median
+    offset of every segment, which is size // 2 as in splitters.median_split.
+    """
+
+    medians = size // 2
+    width = int(size.max())
+
+    if width == 1:
+        return medians
+
+    columns = np.arange(width)
+
+    positions = lo[:, None] + columns
+    positions[columns >= size[:, None]] = len(order) - 1
+
+    members = order[positions]
+
+    ranks = np.argpartition(keys[members], np.union1d(medians, width - 1), axis=1)
+    order[positions] = np.take_along_axis(members, ranks, axis=1)
+
+    return medians
+
+
+def create(points, dimension=None, axis=0, layout='level'):
+    """
+    Creates a flat kd-tree from a sequence of points or an (n, k) array
+
+    The tree has the same shape as kdtree.create with median_split: every
+    node holds the median point of its subtree on an axis that cycles with
+    depth. Medians are found by linear-time selection over a whole tree
+    level at once, so construction costs O(n log n). Among points sharing
+    the median coordinate any one may be chosen, so trees with duplicated
+    coordinates can differ from kdtree.create in which of the equal points
+    sits at a node. Coordinates must be finite. tree.indices maps positions
+    in tree.points back to the input. Layout orders the nodes as in
+    FlatTree.relayout.
+    """
+
+    if layout not in LAYOUTS:
+        raise ValueError('layout must be one of %s' % ', '.join(LAYOUTS))
+
+    data = np.asarray(points, dtype=np.float64)
+
+    if dimension is None:
+        dimension = data.shape[1] if data.ndim == 2 else 0
+
+    data = data.reshape(-1, dimension) if data.size else data.reshape(0, dimension)
+    n = len(data)
+
+    order = np.arange(n + 1)
+    columns = [np.append(data[:, i], np.inf) for i in range(dimension)]
+
+    pivot = np.empty(n, dtype=np.intp)
+    axes = np.empty(n, dtype=np.int8)
+    left = np.full(n, EMPTY, dtype=np.intp)
+    right = np.full(n, EMPTY, dtype=np.intp)
+    start = np.empty(n, dtype=np.intp)
+    end = np.empty(n, dtype=np.intp)
+
+    lo = np.zeros(1 if n else 0, dtype=np.intp)
+    size = np.full(len(lo), n, dtype=np.intp)
+
+    height = 0
+    count = 0
+
+    stats = instrumentation.active
+
+    if stats is not None:
+        began = time.perf_counter()
+        split_time = stats.times['split']
+
+    while len(lo):
+        ids = np.arange(count, count + len(lo))
+        count += len(lo)
+
+        if stats is None:
+            medians = select_medians(columns[axis], order, lo, size)
+        else:
+            with stats.phase('split'):
+                medians = select_medians(columns[axis], order, lo, size)
+
+            stats.counters['splits'] += len(lo)
+            stats.counters['points_sorted'] += int(size.sum())
+
+        pivot[ids] = lo + medians
+        axes[ids] = axis
+        start[ids] = lo
+        end[ids] = lo + size
+
+        left_size = medians
+        right_size = size - medians - 1
+
+        has_left = left_size > 0
+        has_right = right_size > 0
+
+        offsets = count + np.cumsum(has_left + has_right.astype(np.intp)) - has_left - has_right
+        left[ids[has_left]] = offsets[has_left]
+        right[ids[has_right]] = (offsets + has_left)[has_right]
+
+        lo = np.stack((lo, lo + medians + 1), axis=1).ravel()
+        size = np.stack((left_size, right_size), axis=1).ravel()
+
+        lo = lo[size > 0]
+        size = size[size > 0]
+
+        axis = (axis + 1) % dimension
+        height += 1
+
+    order = order[:n]
+
+    if stats is not None:
+        stats.times['recurse'] += time.perf_counter() - began - (stats.times['split'] - split_time)
+
+    tree = FlatTree(np.ascontiguousarray(data[order]), order, pivot, axes, left, right, start, end, height)
+
+    return tree if layout == 'level' else tree.relayout(layout)
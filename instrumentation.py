@@ -0,0 +1,194 @@
+"""
+    File name: instrumentation.py
+    License: MIT
+    Author: Orlov Michael
+    Date created: 18.10.2026
+    Python Version: 3.5
+    Description: opt-in counters and phase timers for builds and queries
+
+    Usage:
+        with instrumentation.collect() as stats:
+            tree = kdtree.create(points, 2)
+            tree.nearest((1, 1))
+
+        print(stats.counters['nodes_visited'], stats.times['split'])
+"""
+
+
+from collections import defaultdict
+import functools
+import time
+
+
+# the Stats instrumented code records into, None while disabled
+active = None
+
+
+class Stats(object):
+    """
+    Counters and per-phase wall times
+
+    Counters are nodes_visited, leaves_visited, comparisons (of a
+    coordinate against a split plane or of a cell against a query region),
+    distance_evaluations, splits, points_sorted (the points handed to the
+    splitter, summed over splits), cache_hits and cache_misses. Times are
+    seconds spent in the split, recurse, transform, prune and hull phases;
+    recurse is the part of a build not spent in the splitter.
+    """
+
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.times = defaultdict(float)
+
+    def __repr__(self):
+        return '<%(cls)s - %(counters)s %(times)s>' % \
+               dict(cls=self.__class__.__name__, counters=dict(self.counters), times=dict(self.times))
+
+    @property
+    def points_per_split(self):
+        """
+        Returns the average number of points sorted per split
+        """
+
+        return self.counters['points_sorted'] / self.counters['splits'] if self.counters['splits'] else 0.0
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def phase(self, name):
+        return _Timer(self, name)
+
+    def timed(self, name, function):
+        """
+        Returns function wrapped to add its running time to phase name
+        """
+
+        def wrapper(*args, **kwargs):
+            began = time.perf_counter()
+
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.times[name] += time.perf_counter() - began
+
+        return wrapper
+
+    def as_dict(self):
+        return {'counters': dict(self.counters), 'times': dict(self.times)}
+
+    def reset(self):
+        self.counters.clear()
+        self.times.clear()
+
+
+class _Timer(object):
+
+    __slots__ = ('stats', 'name', 'began')
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.began = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.stats.times[self.name] += time.perf_counter() - self.began
+
+
+class _NullTimer(object):
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def enable(stats=None):
+    """
+    Starts recording into stats (a new Stats by default) and returns it
+
+    The returned object can be read after any call; recording goes on until
+    disable.
+    """
+
+    global active
+    active = Stats() if stats is None else stats
+    return active
+
+
+def disable():
+    """
+    Stops recording and returns the Stats recorded into, if any
+    """
+
+    global active
+    stats, active = active, None
+    return stats
+
+
+def count(name, amount=1):
+    if active is not None:
+        active.counters[name] += amount
+
+
+def phase(name):
+    """
+    Returns a context manager adding its wall time to phase name
+
+    While disabled it is a shared object doing nothing.
+    """
+
+    if active is None:
+        return _NULL_TIMER
+
+    return _Timer(active, name)
+
+
+def timed(name):
+    """
+    Decorator adding the running time of every call to phase name
+    """
+
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if active is None:
+                return function(*args, **kwargs)
+
+            with _Timer(active, name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+class collect(object):
+    """
+    Context manager recording into a fresh Stats for the duration of a block
+
+    The Stats recording before the block, if any, is restored afterwards
+    and receives nothing from inside the block.
+    """
+
+    def __init__(self, stats=None):
+        self.stats = Stats() if stats is None else stats
+        self.previous = None
+
+    def __enter__(self):
+        global active
+        self.previous = active
+        active = self.stats
+        return self.stats
+
+    def __exit__(self, *args):
+        global active
+        active = self.previous
@@ -8,8 +8,19 @@
 """
 
 
+from array import array
 from collections import deque
-from splitters import median_split
+from multiprocessing import Pool
+import heapq
+import time
+import numpy as np
+import instrumentation
+from splitters import median_split, cycle_axis
+
+
+# a subtree is rebuilt once one of its children holds more than this share
+# of its points
+BALANCE_FACTOR = 0.75
 
 
 class Node(object):
@@ -20,14 +31,85 @@ class Node(object):
     its subtree.
     """
 
-    def __init__(self, data=None, left=None, right=None):
+    # the splitter, axis_selector and leafsize a tree was created with, set
+    # on the root by create and reused when parts of the tree are rebuilt
+    build_options = None
+
+    def __init__(self, data=None, left=None, right=None, axis=0, bucket=None):
         """
         Creates a new node for a kd-tree
+
+        Axis is the axis on which the node splits its subtree.
+
+        Bucket is an optional (m, k) array of further points stored at the
+        node, as created for leaves with leafsize > 1. Bucket points take no
+        part in the split of the node itself but lie within the cell of the
+        node like its other points.
         """
 
         self.data = data
         self.left = left
         self.right = right
+        self.axis = axis
+        self.bucket = bucket
+        self.version = 0
+        self._update()
+
+    def _update(self):
+        """
+        Recomputes the cached size of the node from its children
+
+        The height and bounding box are dropped and recomputed on the next
+        access. The version of the node is increased, so it changes on the
+        root with every insert and remove.
+        """
+
+        self.version += 1
+
+        if self.data is None:
+            self.size = 0
+        else:
+            self.size = 1 + (len(self.bucket) if self.bucket is not None else 0) + \
+                (self.left.size if self.left else 0) + (self.right.size if self.right else 0)
+
+        self._height = None
+        self._bounds = None
+
+    def __setstate__(self, state):
+        """
+        Restores a pickled node
+
+        Nodes pickled before the cached metadata existed hold only data,
+        left and right; their size is recomputed from the children, which
+        are restored first, and height and bounds on the next access. Such
+        trees split on the depth of a node modulo the dimension, starting
+        with axis 0 at the root. Every restored subtree starts at axis 0 as
+        well, so the axes below a node are moved down one level when the
+        node is restored. Nodes holding other data than points, as the dicts
+        of visualization.create_visualization_tree, all keep axis 0.
+        """
+
+        self.__dict__.update(state)
+
+        if 'axis' in state:
+            return
+
+        self.axis = 0
+        self.bucket = None
+        self.version = 0
+
+        if self.data is not None and not isinstance(self.data, dict):
+            dimension = len(self.data)
+            pending = [self.left, self.right]
+
+            while pending:
+                node = pending.pop()
+
+                if node:
+                    node.axis = (node.axis + 1) % dimension
+                    pending.extend((node.left, node.right))
+
+        self._update()
 
     def __repr__(self):
         return '<%(cls)s - %(data)s>' % \
@@ -58,45 +140,307 @@ class Node(object):
         Returns height of the (sub)tree, without considering
         empty leaf-nodes
 
-        >>> create().height()
+        Heights are computed on first access, cached on every node of the
+        subtree and dropped along the path of an update like bounds.
+
+        >>> create([], 2).height
         0
 
-        >>> create([ (1, 2) ]).height()
+        >>> create([ (1, 2) ], 2).height
         1
 
-        >>> create([ (1, 2), (2, 3) ]).height()
+        >>> create([ (1, 2), (2, 3) ], 2).height
         2
         """
-        try:
-            if self.is_leaf:
-                return 1
-            else:
-                return 1 + max(self.left.height, self.right.height)
-        except AttributeError:
-            return 0
+
+        if self._height is None:
+            pending = [self]
+            missing = []
+
+            while pending:
+                node = pending.pop()
+                missing.append(node)
+
+                for child in (node.left, node.right):
+                    if child is not None and child._height is None:
+                        pending.append(child)
+
+            for node in reversed(missing):
+                if node.data is None:
+                    node._height = 0
+                else:
+                    node._height = 1 + max(node.left._height if node.left is not None else 0,
+                                           node.right._height if node.right is not None else 0)
+
+        return self._height
+
+    @property
+    def bounds(self):
+        """
+        Returns the (mins, maxs) corners of the box enclosing the points of
+        the (sub)tree, or None for an empty tree
+
+        Boxes are computed on first access, cached on every node of the
+        subtree and dropped along the path of an update.
+        """
+
+        if self._bounds is None and self:
+            pending = [self]
+            missing = []
+
+            while pending:
+                node = pending.pop()
+                missing.append(node)
+
+                # children are tested by truth value rather than through
+                # children, which reads their data and so would split a
+                # deferred child; its box is taken from its block instead
+                for child in (node.left, node.right):
+                    if child and child._bounds is None:
+                        pending.append(child)
+
+            for node in reversed(missing):
+                mins = maxs = tuple(node.data)
+
+                if node.bucket is not None:
+                    mins = tuple(map(min, mins, node.bucket.min(axis=0).tolist()))
+                    maxs = tuple(map(max, maxs, node.bucket.max(axis=0).tolist()))
+
+                for child in (node.left, node.right):
+                    if child:
+                        mins = tuple(map(min, mins, child._bounds[0]))
+                        maxs = tuple(map(max, maxs, child._bounds[1]))
+
+                node._bounds = mins, maxs
+
+        return self._bounds
 
     def inorder(self):
         """ iterator for nodes: left, root, right """
 
-        if not self:
-            return
+        stack = []
+        node = self
+        visited = 0
 
-        if self.left:
-            for x in self.left.inorder():
-                yield x
+        try:
+            while stack or node:
+                if node:
+                    stack.append(node)
+                    node = node.left
+                else:
+                    node = stack.pop()
+                    visited += 1
+                    yield node
+                    node = node.right
+        finally:
+            instrumentation.count('nodes_visited', visited)
+
+    def points(self):
+        """
+        Returns an iterator over the points of the (sub)tree in inorder,
+        every node followed by the points of its bucket
+        """
 
-        yield self
+        for node in self.inorder():
+            yield node.data
 
-        if self.right:
-            for x in self.right.inorder():
-                yield x
+            if node.bucket is not None:
+                for row in node.bucket.tolist():
+                    yield tuple(row)
 
-    def rebalance(self):
+    def rebalance(self, **kwargs):
         """
         Returns the (possibly new) root of the rebalanced tree
+
+        Keyword arguments (splitter, axis_selector, leafsize) are passed to
+        create; those not given are taken from the build options of the
+        tree.
+        """
+
+        options = dict(self.build_options or {})
+        options.update(kwargs)
+
+        if not self:
+            return _with_options(Node(), options)
+
+        return create(list(self.points()), len(self.data), axis=self.axis, **options)
+
+    def insert(self, point):
         """
+        Adds a point to the tree in place and returns the root
 
-        return create([x.data for x in self.inorder()], dimension=2)
+        The point goes to the leaf its coordinates lead to. If that leaves
+        some subtree on the path with a child holding more than
+        BALANCE_FACTOR of its points, the highest such subtree is rebuilt,
+        so updates cost amortized polylogarithmic time instead of a full
+        rebuild.
+        """
+
+        if not self:
+            self.data = point
+            self.left = Node()
+            self.right = Node()
+            self._update()
+            return self
+
+        path = []
+        node = self
+
+        while node:
+            path.append(node)
+            node = node.left if point[node.axis] < node.data[node.axis] else node.right
+
+        parent = path[-1]
+        leaf = Node(point, Node(), Node(), (parent.axis + 1) % len(point))
+
+        if point[parent.axis] < parent.data[parent.axis]:
+            parent.left = leaf
+        else:
+            parent.right = leaf
+
+        for node in reversed(path):
+            node._update()
+
+        _rebuild_unbalanced(path, self.build_options)
+
+        return self
+
+    def remove(self, point):
+        """
+        Removes one occurrence of a point from the tree in place and returns
+        the root
+
+        The removed node takes over the point with the smallest coordinate
+        on its axis from its right subtree (or from its left subtree, which
+        then becomes the right one), down to a leaf. The path is then
+        rebalanced as in insert. Raises ValueError if the point is not in
+        the tree.
+        """
+
+        path = self._find(point)
+
+        if path is None:
+            raise ValueError('point is not in the tree')
+
+        node = path[-1]
+
+        if tuple(node.data) != tuple(point):
+            node._pop_row(_bucket_row(node.bucket, point))
+            node = None
+
+        while node is not None and (node.left or node.right):
+            if not node.right:
+                node.left, node.right = Node(), node.left
+
+            replacement_path, row = node.right._find_min(node.axis)
+            path.extend(replacement_path)
+
+            if row is None:
+                node.data = replacement_path[-1].data
+                node = replacement_path[-1]
+            else:
+                node.data = replacement_path[-1]._pop_row(row)
+                node = None
+
+        if node is not None and node.bucket is not None:
+            node.data = node._pop_row(0)
+        elif node is not None:
+            node.data = None
+            node.left = None
+            node.right = None
+
+        for node in reversed(path):
+            node._update()
+
+        _rebuild_unbalanced(path[:-1], self.build_options)
+
+        return self
+
+    def _find(self, point):
+        """
+        Returns the path from this node to a node holding point, or None
+        """
+
+        point = tuple(point)
+        stack = [self] if self else []
+        parents = {}
+
+        while stack:
+            node = stack.pop()
+
+            if tuple(node.data) == point or \
+                    (node.bucket is not None and _bucket_row(node.bucket, point) is not None):
+                return self._path_to(node, parents)
+
+            if point[node.axis] <= node.data[node.axis] and node.left:
+                parents[id(node.left)] = node
+                stack.append(node.left)
+
+            if point[node.axis] >= node.data[node.axis] and node.right:
+                parents[id(node.right)] = node
+                stack.append(node.right)
+
+        return None
+
+    def _find_min(self, axis):
+        """
+        Returns the path from this node to a node holding the smallest
+        coordinate on axis, and the bucket row of that point or None if it
+        is the data of the node
+        """
+
+        best = None
+        best_row = None
+        best_value = None
+        stack = [self]
+        parents = {}
+
+        while stack:
+            node = stack.pop()
+
+            if best is None or node.data[axis] < best_value:
+                best, best_row, best_value = node, None, node.data[axis]
+
+            if node.bucket is not None:
+                row = int(node.bucket[:, axis].argmin())
+
+                if node.bucket[row, axis] < best_value:
+                    best, best_row, best_value = node, row, node.bucket[row, axis]
+
+            if node.left:
+                parents[id(node.left)] = node
+                stack.append(node.left)
+
+            if node.right and node.axis != axis:
+                parents[id(node.right)] = node
+                stack.append(node.right)
+
+        return self._path_to(best, parents), best_row
+
+    def _path_to(self, node, parents):
+        """
+        Returns the path from this node down to node, given the parent of
+        every node below this one on the way
+        """
+
+        path = [node]
+
+        while node is not self:
+            node = parents[id(node)]
+            path.append(node)
+
+        path.reverse()
+        return path
+
+    def _pop_row(self, row):
+        """
+        Removes a row from the bucket and returns it as a point
+        """
+
+        point = tuple(self.bucket[row].tolist())
+        self.bucket = np.delete(self.bucket, row, axis=0) if len(self.bucket) > 1 else None
+
+        return point
 
     @property
     def children(self):
@@ -129,13 +473,125 @@ class Node(object):
         The tree is balanced if the heights of both subtrees differ at most by 1
         """
 
-        left_height = self.left.height if self.left else 0
-        right_height = self.right.height if self.right else 0
+        return all(abs((node.left.height if node.left else 0) -
+                       (node.right.height if node.right else 0)) <= 1
+                   for node in self.inorder())
 
-        if abs(left_height - right_height) > 1:
-            return False
+    def nearest(self, point, k=1, eps=0, max_leaves=None):
+        """
+        Returns the k points of the tree nearest to point
+
+        The result is a pair of lists (distances, points) ordered by
+        increasing euclidean distance. Subtrees lying farther from point
+        than the current k-th neighbour, either across the split plane of
+        their parent or from their bounding box, are skipped. Leaf buckets
+        are scanned in one vectorized step.
+
+        With eps > 0 the search is approximate: subtrees that cannot hold a
+        point closer than the current k-th neighbour divided by (1 + eps)
+        are skipped too, so the i-th returned distance is at most (1 + eps)
+        times the true i-th distance. Max leaves stops the search after
+        that many leaves have been visited, without any bound. The number
+        of visited nodes and leaves is recorded by instrumentation.
+
+        >>> create([ (1, 2), (2, 3), (5, 5) ], 2).nearest((1, 1))
+        ([1.0], [(1, 2)])
+        """
 
-        return all(c.is_balanced for c, _ in self.children())
+        if k < 1:
+            raise ValueError('k must be positive')
+
+        if eps < 0:
+            raise ValueError('eps must not be negative')
+
+        if max_leaves is not None and max_leaves < 1:
+            raise ValueError('max_leaves must be positive')
+
+        # squared distances are compared, so is the error factor
+        factor = (1 + eps) ** 2
+
+        heap = []
+        stack = [(self, 0)] if self else []
+
+        visited = 0
+        leaves = 0
+        box_distances = 0
+        bucket_distances = 0
+
+        # heap entries are (-distance, push counter, point); the counter
+        # keeps points from being compared on equal distances
+        pushed = 0
+
+        while stack:
+            node, plane_distance = stack.pop()
+
+            if len(heap) == k:
+                if plane_distance * factor >= -heap[0][0]:
+                    continue
+
+                mins, maxs = node.bounds
+                box_distance = sum((c - min(max(c, lo), hi)) ** 2 for c, lo, hi in zip(point, mins, maxs))
+                box_distances += 1
+
+                if box_distance * factor >= -heap[0][0]:
+                    continue
+
+            visited += 1
+            distance = sum((a - b) ** 2 for a, b in zip(point, node.data))
+
+            if len(heap) < k:
+                heapq.heappush(heap, (-distance, pushed, node.data))
+            elif distance < -heap[0][0]:
+                heapq.heapreplace(heap, (-distance, pushed, node.data))
+
+            pushed += 1
+
+            if node.bucket is not None:
+                distances = ((node.bucket - np.asarray(point, dtype=np.float64)) ** 2).sum(axis=1)
+                bucket_distances += len(distances)
+
+                for row in np.argsort(distances)[:k].tolist():
+                    distance = float(distances[row])
+
+                    if len(heap) < k:
+                        heapq.heappush(heap, (-distance, pushed, tuple(node.bucket[row].tolist())))
+                    elif distance < -heap[0][0]:
+                        heapq.heapreplace(heap, (-distance, pushed, tuple(node.bucket[row].tolist())))
+                    else:
+                        break
+
+                    pushed += 1
+
+            diff = point[node.axis] - node.data[node.axis]
+
+            if diff < 0:
+                near, far = node.left, node.right
+            else:
+                near, far = node.right, node.left
+
+            if far:
+                stack.append((far, diff * diff))
+
+            if near:
+                stack.append((near, 0))
+
+            if node.bucket is not None or not (node.left or node.right):
+                leaves += 1
+
+                if max_leaves is not None and leaves >= max_leaves:
+                    break
+
+        stats = instrumentation.active
+
+        if stats is not None:
+            stats.counters['nodes_visited'] += visited
+            stats.counters['leaves_visited'] += leaves
+            stats.counters['comparisons'] += visited
+            stats.counters['distance_evaluations'] += visited + box_distances + bucket_distances
+
+        heap.sort(reverse=True)
+
+        return [(-d) ** 0.5 for d, _, _ in heap], [p for _, _, p in heap]
 
     def level_order(self):
         """
@@ -144,20 +600,91 @@ class Node(object):
 
         nodes_deque = deque()
         nodes_deque.append(self)
+        visited = 0
 
-        while nodes_deque:
-            node = nodes_deque.popleft()
+        try:
+            while nodes_deque:
+                node = nodes_deque.popleft()
+                visited += 1
 
-            yield node
+                yield node
 
-            if node.left:
-                nodes_deque.append(node.left)
+                if node.left:
+                    nodes_deque.append(node.left)
+
+                if node.right:
+                    nodes_deque.append(node.right)
+        finally:
+            instrumentation.count('nodes_visited', visited)
+
+
+class _Deferred(Node):
+    """
+    A node of a lazily built tree whose points have not been split yet
+
+    The points are kept as a block until an attribute of the node is first
+    read, which splits them once: the node takes the split point, and each
+    side becomes a deferred node of its own. Size, truth value and
+    bounding box are answered from the block without splitting it, so a
+    query pruning the subtree never pays for its construction. After the
+    split the node behaves as any other node.
+    """
+
+    def __init__(self, points, dimension, axis, splitter, axis_selector, leafsize):
+        self._block = points, dimension, axis, splitter, axis_selector, leafsize
+        self.size = len(points)
+        self.version = 0
+
+    def __getattr__(self, name):
+        # only reached for attributes missing before the split
+        block = self.__dict__.get('_block')
+
+        if block is None:
+            raise AttributeError(name)
+
+        if name == '_bounds':
+            points = np.array(block[0], dtype=np.float64)
+            self._bounds = tuple(points.min(axis=0).tolist()), tuple(points.max(axis=0).tolist())
+            return self._bounds
+
+        self._split()
+
+        return getattr(self, name)
+
+    def __nonzero__(self):
+        return self.size > 0
 
-            if node.right:
-                nodes_deque.append(node.right)
+    __bool__ = __nonzero__
+
+    def _split(self):
+        points, dimension, axis, splitter, axis_selector, leafsize = self.__dict__.pop('_block')
+        left = right = bucket = None
+
+        if leafsize > 1 and len(points) <= leafsize:
+            data, bucket = points[0], _bucket(points[1:], dimension)
+        else:
+            axis = axis_selector(points, axis)
+            left_points, data, right_points = splitter(points, axis)
+
+            if left_points:
+                left = _Deferred(left_points, dimension, (axis + 1) % dimension, splitter, axis_selector, leafsize)
+
+            if right_points:
+                right = _Deferred(right_points, dimension, (axis + 1) % dimension, splitter, axis_selector, leafsize)
+
+        self.data = data
+        self.left = Node() if left is None else left
+        self.right = Node() if right is None else right
+        self.axis = axis
+        self.bucket = bucket
+        self._height = None
 
+        if '_bounds' not in self.__dict__:
+            self._bounds = None
 
-def create(points, dimension, axis=0, splitter=median_split):
+
+def create(points, dimension, axis=0, splitter=median_split, workers=1,
+           axis_selector=cycle_axis, leafsize=1, lazy=False):
     """
     Creates a kd-tree from a list of points
 
@@ -167,14 +694,233 @@ def create(points, dimension, axis=0, splitter=median_split):
 
     Axis is the axis on which the root-node should split.
 
-    Splitter is a condition that splits the sample into two parts.
+    Splitter is a condition that splits the sample into two parts, such as
+    median_split, sliding_midpoint_split or three_way_split from splitters.
+
+    Axis selector chooses the split axis of every node from its points and
+    the axis cycled from its parent: cycle_axis keeps the cycled axis and
+    widest_axis takes the one with the largest spread.
+
+    Sets of at most leafsize points are not split further: the first point
+    becomes the data of a leaf and the others are stored as a NumPy array
+    in its bucket. A leafsize of 32 cuts the number of nodes by an order of
+    magnitude.
+
+    Workers is the number of processes building the tree. With more than one
+    worker the top levels are split in this process and the independent
+    subtrees below them are built in a process pool; the resulting tree is
+    identical to the one built serially. The splitter and axis selector
+    must be picklable. Worker processes do not record instrumentation.
+    The speedup is bounded well below the number of workers: this process
+    still splits the top levels and creates every Node of the result from
+    the subtrees the workers return. At 200,000 2-d points that serial part
+    takes 1.6 s of a 3.1 s serial build with 2 workers and 2.6 s with 32,
+    which caps the speedup at about 1.3 times.
+
+    The splitter, axis selector and leafsize are kept in the build_options
+    of the root, so the subtrees rebuilt by insert and remove and the tree
+    returned by rebalance are built the same way.
+
+    With lazy set only the root is split up front. Every other subtree
+    keeps its points unsplit until a query, traversal or update first
+    reaches it, so building costs a single split and the total work is
+    proportional to the parts of the tree actually visited. Reading the
+    height splits the whole tree. A lazy tree is built serially.
+    """
+
+    if leafsize < 1:
+        raise ValueError('leafsize must be positive')
+
+    options = dict(splitter=splitter, axis_selector=axis_selector, leafsize=leafsize)
+
+    if lazy:
+        if workers > 1:
+            raise ValueError('lazy trees are built serially')
+
+        if points is None or not points:
+            return _with_options(Node(), options)
+
+        root = _Deferred(list(points), dimension, axis, splitter, axis_selector, leafsize)
+        root._split()
+
+        return _with_options(root, options)
+
+    if workers > 1:
+        return _with_options(_create_parallel(points, dimension, axis, splitter, workers, axis_selector,
+                                              leafsize), options)
+
+    stats = instrumentation.active
+
+    if stats is not None:
+        began = time.perf_counter()
+        split_time = stats.times['split']
+        splitter = stats.timed('split', splitter)
+
+    # points are split top-down with an explicit stack; the nodes are then
+    # created bottom-up, as every node caches metadata of its children
+    splits = []
+    stack = [(points, axis, None, None)]
+
+    while stack:
+        points, axis, parent, side = stack.pop()
+
+        if points is None or not points:
+            continue
+
+        if parent is not None:
+            splits[parent][side] = len(splits)
+
+        if leafsize > 1 and len(points) <= leafsize:
+            splits.append([points[0], axis, None, None, _bucket(points[1:], dimension)])
+            continue
+
+        axis = axis_selector(points, axis)
+        left_points, loc, right_points = splitter(points, axis)
+
+        splits.append([loc, axis, None, None, None])
+
+        stack.append((right_points, (axis + 1) % dimension, len(splits) - 1, 3))
+        stack.append((left_points, (axis + 1) % dimension, len(splits) - 1, 2))
+
+    nodes = [None] * len(splits)
+
+    for i in range(len(splits) - 1, -1, -1):
+        loc, axis, left, right, bucket = splits[i]
+
+        nodes[i] = Node(loc,
+                        Node() if left is None else nodes[left],
+                        Node() if right is None else nodes[right],
+                        axis, bucket)
+
+    if stats is not None:
+        stats.times['recurse'] += time.perf_counter() - began - (stats.times['split'] - split_time)
+
+    return _with_options(nodes[0] if nodes else Node(), options)
+
+
+def _with_options(root, options):
+    root.build_options = options
+    return root
+
+
+def _bucket(points, dimension):
+    if not points:
+        return None
+
+    return np.array(points, dtype=np.float64).reshape(-1, dimension)
+
+
+def _bucket_row(bucket, point):
     """
+    Returns the index of a row of bucket equal to point, or None
+    """
+
+    rows = np.flatnonzero((bucket == np.asarray(point, dtype=np.float64)).all(axis=1))
+
+    return int(rows[0]) if len(rows) else None
+
+
+def _rebuild_unbalanced(path, options):
+    for node in path:
+        heavier = max(node.left.size if node.left else 0, node.right.size if node.right else 0)
+
+        if heavier > BALANCE_FACTOR * node.size:
+            rebuilt = node.rebalance(**(options or {}))
+
+            node.data = rebuilt.data
+            node.left = rebuilt.left
+            node.right = rebuilt.right
+            node.axis = rebuilt.axis
+            node.bucket = rebuilt.bucket
+            node._update()
+
+            for ancestor in reversed(path[:path.index(node)]):
+                ancestor._update()
+
+            return
+
+
+def _create_parallel(points, dimension, axis, splitter, workers, axis_selector, leafsize):
+    # one subtree per worker: the top levels are split until there are at
+    # least as many independent point sets as workers
+    split_depth = (workers - 1).bit_length()
+    tasks = []
+
+    def split(points, axis, depth):
+        if depth == split_depth or points is None or not points or len(points) <= leafsize:
+            tasks.append((points, dimension, axis, splitter, 1, axis_selector, leafsize))
+            return len(tasks) - 1
+
+        axis = axis_selector(points, axis)
+        left_points, loc, right_points = splitter(points, axis)
+        next_axis = (axis + 1) % dimension
+
+        return loc, split(left_points, next_axis, depth + 1), split(right_points, next_axis, depth + 1), axis
+
+    top = split(None if points is None else list(points), axis, 0)
+
+    # every task is sent to the one worker building it, with chunks of one
+    # task, so no worker receives the points of the others
+    with Pool(workers) as pool:
+        subtrees = [_decode_tree(task[0], *encoded)
+                    for task, encoded in zip(tasks, pool.map(_build_task, tasks, chunksize=1))]
+
+    def stitch(node):
+        if isinstance(node, int):
+            return subtrees[node]
+
+        loc, left, right, axis = node
+        return Node(loc, stitch(left), stitch(right), axis)
+
+    return stitch(top)
+
+
+def _build_task(task):
+    # pickling a graph of Nodes back to the parent costs as much as building
+    # it, so the subtree is returned as a preorder list of (position of the
+    # point in the task list, axis, child flags) instead, with the bucket
+    # arrays in the same order
+    points = task[0]
+    tree = create(*task)
+
+    positions = dict((id(p), i) for i, p in enumerate(points or []))
+    indices = array('q')
+    axes = array('b')
+    flags = array('b')
+    buckets = []
+
+    stack = [tree] if tree else []
+
+    while stack:
+        node = stack.pop()
+
+        indices.append(positions[id(node.data)])
+        axes.append(node.axis)
+        flags.append((1 if node.left else 0) | (2 if node.right else 0) | (4 if node.bucket is not None else 0))
+
+        if node.bucket is not None:
+            buckets.append(node.bucket)
+
+        if node.right:
+            stack.append(node.right)
+
+        if node.left:
+            stack.append(node.left)
+
+    return indices, axes, flags, buckets
+
+
+def _decode_tree(points, indices, axes, flags, buckets):
+    # walking the preorder backwards, the subtrees of a node are complete
+    # and on top of the stack when the node itself is reached
+    stack = []
+
+    for i in range(len(indices) - 1, -1, -1):
+        left = stack.pop() if flags[i] & 1 else Node()
+        right = stack.pop() if flags[i] & 2 else Node()
 
-    if points is None or not points:
-        return Node()
+        bucket = buckets.pop() if flags[i] & 4 else None
 
-    left_points, loc, right_points = splitter(points, axis)
+        stack.append(Node(points[indices[i]], left, right, axes[i], bucket))
 
-    left = create(left_points, dimension, axis=(axis + 1) % dimension)
-    right = create(right_points, dimension, axis=(axis + 1) % dimension)
-    return Node(loc, left, right)
+    return stack[0] if stack else Node()
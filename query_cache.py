@@ -0,0 +1,140 @@
+"""
+    File name: query_cache.py
+    License: MIT
+    Author: Orlov Michael
+    Date created: 18.10.2026
+    Python Version: 3.5
+    Description: bounded LRU cache for repeated kd-tree queries
+"""
+
+
+from collections import OrderedDict, namedtuple
+
+import instrumentation
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class CachedTree(object):
+    """
+    A kd-tree behind an LRU cache of query results
+
+    Nearest queries are cached for a kdtree.Node or a FlatTree; range and
+    radius queries only exist on a FlatTree (or CompactTree) and raise
+    TypeError on a kdtree.Node. Results are keyed by their method, query
+    point or region and parameters; the least recently used result is
+    dropped once maxsize results are kept. The cache is emptied whenever
+    the version of the tree changes, which kdtree.Node does on every insert
+    and remove made through the root, and when the tree is replaced by
+    rebalance. Other attributes are those of the wrapped tree.
+
+    Cached results are shared between calls and must not be modified.
+    """
+
+    def __init__(self, tree, maxsize=1024):
+        if maxsize < 1:
+            raise ValueError('maxsize must be positive')
+
+        self.tree = tree
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+        self._results = OrderedDict()
+        self._version = getattr(tree, 'version', 0)
+
+    def __repr__(self):
+        return '<%(cls)s - %(tree)r>' % dict(cls=self.__class__.__name__, tree=self.tree)
+
+    def __getattr__(self, name):
+        if name == 'tree':
+            raise AttributeError(name)
+
+        return getattr(self.tree, name)
+
+    def __len__(self):
+        return len(self.tree)
+
+    def __nonzero__(self):
+        return bool(self.tree)
+
+    __bool__ = __nonzero__
+
+    def cache_info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._results))
+
+    def cache_clear(self):
+        """
+        Drops the cached results and resets the statistics
+        """
+
+        self._results.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def nearest(self, point, k=1, **kwargs):
+        return self._query(('nearest', _key(point), k, tuple(sorted(kwargs.items()))),
+                           lambda: self.tree.nearest(point, k, **kwargs))
+
+    def range_query(self, lo, hi, count_only=False):
+        self._require('range_query')
+        return self._query(('range', _key(lo), _key(hi), count_only),
+                           lambda: self.tree.range_query(lo, hi, count_only))
+
+    def radius_query(self, center, r, count_only=False):
+        self._require('radius_query')
+        return self._query(('radius', _key(center), float(r), count_only),
+                           lambda: self.tree.radius_query(center, r, count_only))
+
+    def insert(self, point):
+        self.tree.insert(point)
+        return self
+
+    def remove(self, point):
+        self.tree.remove(point)
+        return self
+
+    def rebalance(self, **kwargs):
+        """
+        Replaces the tree by its rebalanced copy and empties the cache
+        """
+
+        self.tree = self.tree.rebalance(**kwargs)
+        self._results.clear()
+        self._version = getattr(self.tree, 'version', 0)
+
+        return self
+
+    def _require(self, method):
+        if not hasattr(self.tree, method):
+            raise TypeError('%s needs a FlatTree, not %s' % (method, type(self.tree).__name__))
+
+    def _query(self, key, compute):
+        version = getattr(self.tree, 'version', 0)
+
+        if version != self._version:
+            self._results.clear()
+            self._version = version
+
+        results = self._results
+
+        if key in results:
+            results.move_to_end(key)
+            self.hits += 1
+            instrumentation.count('cache_hits')
+            return results[key]
+
+        self.misses += 1
+        instrumentation.count('cache_misses')
+
+        result = results[key] = compute()
+
+        if len(results) > self.maxsize:
+            results.popitem(last=False)
+
+        return result
+
+
+def _key(point):
+    return tuple(float(x) for x in point)
@@ -0,0 +1,191 @@
+"""
+    File name: render.py
+    License: MIT
+    Author: Orlov Michael
+    Date created: 18.10.2026
+    Python Version: 3.5
+    Description: headless rendering of large 2-d kd-trees to image files
+
+    Usage:
+        python render.py tree.kdt tree.png --max-depth 16
+"""
+
+
+import argparse
+import sys
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.cm import ScalarMappable
+from matplotlib.colors import Normalize
+from matplotlib.figure import Figure
+
+from flat_kdtree import FlatTree, EMPTY
+import storage
+
+
+# points are binned into the pixel grid this many at a time
+CHUNK_SIZE = 1 << 18
+
+# share of the extent of the points added around them
+MARGIN = 0.02
+
+
+def split_segments(tree, scale, max_depth=None, min_cell_pixels=2.0):
+    """
+    Returns the split lines of a 2-d FlatTree as (segments, depths)
+
+    Segments is an (m, 2, 2) array of line end points, each split drawn
+    across the cell of its node, and depths the depth of every node. The
+    tree is walked one level at a time with NumPy. A node is left out,
+    together with its subtree, below max_depth levels or when its cell is
+    narrower than min_cell_pixels in either direction at scale pixels per
+    unit.
+    """
+
+    mins, maxs = tree.bounds
+    nodes = np.array([tree.root] if tree else [], dtype=np.intp)
+    cells = np.array([[mins[0], mins[1], maxs[0], maxs[1]]] * len(nodes), dtype=np.float64)
+
+    segments = []
+    depths = []
+    depth = 0
+
+    while len(nodes) and (max_depth is None or depth < max_depth):
+        pixels = (cells[:, 2:] - cells[:, :2]) * scale
+        kept = pixels.min(axis=1) >= min_cell_pixels
+        nodes = nodes[kept]
+        cells = cells[kept]
+
+        if not len(nodes):
+            break
+
+        axes = tree.split_axis[nodes].astype(np.intp)
+        split = tree.points[tree.pivot[nodes], axes]
+        rows = np.arange(len(nodes))
+
+        # a split on x runs from the bottom to the top of the cell, a split
+        # on y from its left to its right side
+        start = cells[:, :2].copy()
+        end = cells[:, 2:].copy()
+        start[rows, axes] = split
+        end[rows, axes] = split
+
+        segments.append(np.stack((start, end), axis=1))
+        depths.append(np.full(len(nodes), depth))
+
+        left_cells = cells.copy()
+        left_cells[rows, axes + 2] = split
+        right_cells = cells.copy()
+        right_cells[rows, axes] = split
+
+        left = tree.children_left[nodes]
+        right = tree.children_right[nodes]
+
+        nodes = np.concatenate((left[left != EMPTY], right[right != EMPTY]))
+        cells = np.concatenate((left_cells[left != EMPTY], right_cells[right != EMPTY]))
+        depth += 1
+
+    if not segments:
+        return np.empty((0, 2, 2)), np.empty(0, dtype=np.intp)
+
+    return np.concatenate(segments), np.concatenate(depths)
+
+
+def point_density(points, lo, hi, shape):
+    """
+    Returns the number of points falling in every pixel of a grid of the
+    given (height, width) shape spanning the box lo..hi
+    """
+
+    counts = np.zeros(shape)
+
+    for first in range(0, len(points), CHUNK_SIZE):
+        chunk = np.asarray(points[first:first + CHUNK_SIZE])
+        counts += np.histogram2d(chunk[:, 1], chunk[:, 0], bins=shape,
+                                 range=((lo[1], hi[1]), (lo[0], hi[0])))[0]
+
+    return counts
+
+
+def render_tree(tree, path, size=(1024, 1024), dpi=100, max_depth=None, min_cell_pixels=2.0,
+                draw_points=True, colormap='viridis'):
+    """
+    Writes a picture of a 2-d kd-tree to path, as PNG, SVG or any other
+    format matplotlib knows from the file extension
+
+    Split lines are colored by depth; all lines of a depth form a single
+    NaN-separated polyline, which Agg draws far faster than a collection
+    of separate segments. Level of detail is bounded by max_depth and
+    min_cell_pixels as in split_segments, so the drawing holds at most
+    about one line per min_cell_pixels squared pixels however large the
+    tree is. The points are drawn as a density image of
+    size pixels, binned in chunks. No display is needed: the figure is
+    drawn by Agg without pyplot. A kdtree.Node tree is converted to a
+    FlatTree first.
+    """
+
+    if not isinstance(tree, FlatTree):
+        tree = FlatTree.from_tree(tree, len(tree.data) if tree else 2)
+
+    if tree.dimension != 2:
+        raise ValueError('only 2-d trees can be rendered')
+
+    figure = Figure(figsize=(size[0] / dpi, size[1] / dpi), dpi=dpi)
+    FigureCanvasAgg(figure)
+
+    axes = figure.add_axes([0, 0, 1, 1])
+    axes.set_axis_off()
+
+    if tree:
+        mins, maxs = tree.bounds
+        extent = np.where(maxs > mins, maxs - mins, 1.0)
+        lo = mins - MARGIN * extent
+        hi = maxs + MARGIN * extent
+        scale = np.array(size) / (hi - lo)
+
+        if draw_points:
+            # the axes fill the figure, so the density grid maps one to one
+            # onto the pixels and is placed without resampling
+            density = np.log1p(point_density(tree.points, lo, hi, (size[1], size[0])))
+            gray = (255 - 255 * density / max(density.max(), 1)).astype(np.uint8)
+            image = np.dstack((gray, gray, gray, np.full_like(gray, 255)))
+
+            figure.figimage(image, origin='lower', zorder=-1)
+
+        segments, depths = split_segments(tree, scale, max_depth, min_cell_pixels)
+
+        if len(segments):
+            colors = ScalarMappable(Normalize(0, max(depths.max(), 1)), colormap)
+
+            for depth in range(depths.max() + 1):
+                level = segments[depths == depth]
+                gaps = np.full((len(level), 1, 2), np.nan)
+                line = np.concatenate((level, gaps), axis=1).reshape(-1, 2)
+
+                axes.plot(line[:, 0], line[:, 1], color=colors.to_rgba(depth), linewidth=0.5)
+
+        axes.set_xlim(lo[0], hi[0])
+        axes.set_ylim(lo[1], hi[1])
+
+    figure.savefig(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='render a kd-tree file to an image')
+    parser.add_argument('tree', help='tree file written by storage.save')
+    parser.add_argument('output', help='image path; the extension selects the format')
+    parser.add_argument('--size', type=int, nargs=2, default=[1024, 1024])
+    parser.add_argument('--max-depth', type=int, default=None)
+    parser.add_argument('--min-cell-pixels', type=float, default=2.0)
+    parser.add_argument('--no-points', action='store_true')
+
+    args = parser.parse_args(argv)
+
+    render_tree(storage.load(args.tree), args.output, size=tuple(args.size), max_depth=args.max_depth,
+                min_cell_pixels=args.min_cell_pixels, draw_points=not args.no_points)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
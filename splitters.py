@@ -5,12 +5,131 @@
     Date created: 18.10.2017
     Python Version: 3.5
     Description: set of functions for splitting data in each node of kd-tree
+
+    A splitter takes a list of points and an axis and returns the points
+    going to the left subtree, the point kept at the node and the points
+    going to the right subtree. An axis selector takes the points of a node
+    and the axis cycled from its parent and returns the axis to split on.
 """
 
 
+import numpy as np
+
+import instrumentation
+
+
+# largest share of the points a side may hold after taking a whole run of
+# points equal to the split, as the balance factor of kdtree
+RUN_BALANCE = 0.75
+
+
+def _record(points):
+    stats = instrumentation.active
+
+    if stats is not None:
+        stats.counters['splits'] += 1
+        stats.counters['points_sorted'] += len(points)
+
+
+def _place_run(less, equal, greater):
+    """
+    Returns (left, point, right) with the first equal point at the node
+
+    The rest of the run joins the smaller side whole unless that leaves a
+    side with more than RUN_BALANCE of the points; then it is divided so
+    the sides are as even as possible. A long run therefore costs a few
+    levels instead of a chain of one node per point.
+    """
+
+    rest = equal[1:]
+    n = len(less) + len(rest) + len(greater)
+
+    if len(less) <= len(greater):
+        if max(len(less) + len(rest), len(greater)) <= RUN_BALANCE * n:
+            return less + rest, equal[0], greater
+    elif max(len(less), len(rest) + len(greater)) <= RUN_BALANCE * n:
+        return less, equal[0], rest + greater
+
+    middle = max(0, min(len(rest), n // 2 - len(less)))
+
+    return less + rest[:middle], equal[0], rest[middle:] + greater
+
+
 def median_split(points, axis=0):
     points = list(points)
+    _record(points)
+
     points.sort(key=lambda point: point[axis])
     median = len(points) // 2
 
     return points[:median], points[median], points[median + 1:]
+
+
+def sliding_midpoint_split(points, axis=0):
+    """
+    Splits at the middle of the extent of the points on axis
+
+    The split slides from the midpoint to the point nearest to it, so the
+    node always holds a point. Unlike the median, the midpoint adapts to
+    clusters: empty space is cut off in a few splits instead of being
+    spread over many levels. Points equal to the split are placed as in
+    three_way_split.
+    """
+
+    points = list(points)
+    _record(points)
+
+    coordinates = [point[axis] for point in points]
+    middle = (min(coordinates) + max(coordinates)) / 2
+    position = min(range(len(points)), key=lambda i: abs(coordinates[i] - middle))
+    split = coordinates[position]
+
+    less = [p for p, c in zip(points, coordinates) if c < split]
+    equal = [p for p, c in zip(points, coordinates) if c == split]
+    greater = [p for p, c in zip(points, coordinates) if c > split]
+
+    return _place_run(less, equal, greater)
+
+
+def three_way_split(points, axis=0):
+    """
+    Splits at the median, keeping a run of points equal to it together
+    where the tree stays balanced
+
+    The points are partitioned into those below, equal to and above the
+    median coordinate in linear time. One equal point stays at the node and
+    the rest of the run joins the smaller side, so duplicated coordinates
+    are not scattered over both subtrees, unless that side would then hold
+    more than RUN_BALANCE of the points; such a run is divided between the
+    sides instead, which keeps the height logarithmic however many points
+    are equal.
+    """
+
+    points = list(points)
+    _record(points)
+
+    coordinates = np.array([point[axis] for point in points], dtype=np.float64)
+    split = np.partition(coordinates, len(points) // 2)[len(points) // 2]
+
+    less = [p for p, c in zip(points, coordinates) if c < split]
+    equal = [p for p, c in zip(points, coordinates) if c == split]
+    greater = [p for p, c in zip(points, coordinates) if c > split]
+
+    return _place_run(less, equal, greater)
+
+
+def cycle_axis(points, axis):
+    """
+    Keeps the axis cycled from the parent node
+    """
+
+    return axis
+
+
+def widest_axis(points, axis):
+    """
+    Chooses the axis along which the points spread the most
+    """
+
+    coordinates = np.array(points, dtype=np.float64)
+    return int((coordinates.max(axis=0) - coordinates.min(axis=0)).argmax())
@@ -0,0 +1,260 @@
+"""
+    File name: storage.py
+    License: MIT
+    Author: Orlov Michael
+    Date created: 18.10.2026
+    Python Version: 3.5
+    Description: binary on-disk and shared-memory format for flat kd-trees
+
+    Usage:
+        block = storage.publish(tree)            # in the parent process
+        tree = storage.attach(block.name)        # in any worker process
+"""
+
+
+from multiprocessing import resource_tracker, shared_memory
+import mmap
+import os
+import struct
+import sys
+import numpy as np
+
+from flat_kdtree import FlatTree
+
+
+MAGIC = b'KDTREE\0\0'
+FORMAT_VERSION = 1
+
+# magic, version, dimension, number of points, height, root
+HEADER = struct.Struct('<8sIIQIq')
+HEADER_SIZE = 64
+
+# device and inode of the pipe to the resource tracker of the publishing
+# process, kept in the header padding of a shared block; saved files have
+# zeros there
+PUBLISHER = struct.Struct('<QQ')
+PUBLISHER_OFFSET = 48
+
+# every array starts at a multiple of this offset
+ALIGNMENT = 64
+
+# name and on-disk dtype of the arrays following the header, in file order
+ARRAYS = [('points', '<f8'),
+          ('indices', '<i8'),
+          ('pivot', '<i8'),
+          ('split_axis', '<i1'),
+          ('children_left', '<i8'),
+          ('children_right', '<i8'),
+          ('start', '<i8'),
+          ('end', '<i8')]
+
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _layout(dimension, n):
+    """
+    Returns the (name, dtype, shape, offset) of every array and the total
+    size of a tree in the format
+    """
+
+    layout = []
+    offset = HEADER_SIZE
+
+    for name, dtype in ARRAYS:
+        shape = (n, dimension) if name == 'points' else (n,)
+        offset = _aligned(offset)
+
+        layout.append((name, dtype, shape, offset))
+        offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+
+    return layout, offset
+
+
+def _header(tree):
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, tree.dimension, len(tree), tree.height, tree.root)
+    return header.ljust(HEADER_SIZE, b'\0')
+
+
+def _parse_header(header, source):
+    if len(header) < HEADER.size or header[:len(MAGIC)] != MAGIC:
+        raise ValueError('%s is not a kd-tree file' % source)
+
+    _, version, dimension, n, height, root = HEADER.unpack_from(header)
+
+    if version > FORMAT_VERSION:
+        raise ValueError('%s has format version %d, newer than the supported %d' %
+                         (source, version, FORMAT_VERSION))
+
+    return dimension, n, height, root
+
+
+def _tracker():
+    """
+    Returns the device and inode of the pipe to the resource tracker of this
+    process, which are the same in every process sharing the tracker
+    """
+
+    stat = os.fstat(resource_tracker.getfd())
+    return stat.st_dev, stat.st_ino
+
+
+def _open_block(name):
+    """
+    Opens the shared block name without making this process own it
+
+    Before Python 3.13 opening a block registers it with the resource
+    tracker of the process, which unlinks it when the process exits. A
+    process started by the multiprocessing of the publisher shares the
+    tracker of the publisher and keeps the registration, which is the
+    publisher's own; any other process drops it.
+    """
+
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+
+    block = shared_memory.SharedMemory(name=name)
+
+    if os.name == 'posix':
+        publisher = PUBLISHER.unpack_from(block.buf, PUBLISHER_OFFSET)
+
+        if publisher != _tracker():
+            resource_tracker.unregister(block._name, 'shared_memory')
+
+    return block
+
+
+def _as_flat(tree):
+    if not isinstance(tree, FlatTree):
+        tree = FlatTree.from_tree(tree, len(tree.data) if tree else 0)
+
+    return tree
+
+
+def save(tree, path):
+    """
+    Writes a tree to path
+
+    The file is a fixed-size header followed by the flat tree arrays, each
+    aligned to ALIGNMENT bytes. A kdtree.Node tree is converted to a
+    FlatTree first.
+    """
+
+    tree = _as_flat(tree)
+
+    with open(path, 'wb') as f:
+        f.write(_header(tree))
+
+        offset = HEADER_SIZE
+
+        for name, dtype in ARRAYS:
+            f.write(b'\0' * (_aligned(offset) - offset))
+
+            data = np.ascontiguousarray(getattr(tree, name), dtype=dtype)
+            data.tofile(f)
+
+            offset = _aligned(offset) + data.nbytes
+
+
+def load(path, mmap=True):
+    """
+    Opens a tree written by save
+
+    With mmap the arrays are numpy.memmap views of the file: opening costs
+    the same for any tree size, pages are read on first touch and are
+    shared through the page cache by all processes opening the same file.
+    A saved file is thus one way to hand a built tree to worker processes
+    without copying it; publish and attach are the other, without a file.
+    Otherwise the arrays are read into memory.
+    """
+
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+
+    dimension, n, height, root = _parse_header(header, path)
+    arrays = {}
+
+    for name, dtype, shape, offset in _layout(dimension, n)[0]:
+        if mmap and n:
+            arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+        else:
+            arrays[name] = np.fromfile(path, dtype=dtype, count=int(np.prod(shape)),
+                                       offset=offset).reshape(shape)
+
+    return FlatTree(arrays['points'], arrays['indices'], arrays['pivot'], arrays['split_axis'],
+                    arrays['children_left'], arrays['children_right'],
+                    arrays['start'], arrays['end'], height, root)
+
+
+def publish(tree, name=None):
+    """
+    Copies a tree into a new block of shared memory and returns the
+    multiprocessing.shared_memory.SharedMemory holding it
+
+    The block has the layout of a saved file, and any process can open it
+    with attach(block.name) without copying it. The publishing process
+    owns the block: it calls block.close() and block.unlink() once no
+    process needs the tree any more. A kdtree.Node tree is converted to a
+    FlatTree first.
+    """
+
+    tree = _as_flat(tree)
+    layout, size = _layout(tree.dimension, len(tree))
+
+    block = shared_memory.SharedMemory(name=name, create=True, size=size)
+    view = None
+
+    try:
+        block.buf[:HEADER_SIZE] = _header(tree)
+
+        if os.name == 'posix':
+            PUBLISHER.pack_into(block.buf, PUBLISHER_OFFSET, *_tracker())
+
+        for name, dtype, shape, offset in layout:
+            view = np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=offset)
+            view[...] = getattr(tree, name)
+            del view
+    except BaseException:
+        # the block cannot be closed while a view of it is alive
+        view = None
+        block.close()
+        block.unlink()
+        raise
+
+    return block
+
+
+def attach(name):
+    """
+    Opens a tree published under name as read-only views of the shared
+    block, without copying it
+
+    The arrays map the block read-only by themselves and keep it mapped as
+    long as any of them is referenced; unlinking it is left to the
+    publishing process, whether the tree is attached from a worker of the
+    publisher or from an unrelated process.
+    """
+
+    block = _open_block(name)
+
+    # numpy keeps a reference to the buffer of an array, not a buffer export,
+    # so arrays over block.buf would point to unmapped memory once the block
+    # is closed; a mapping of their own is closed only with the last of them
+    try:
+        if os.name == 'posix':
+            mapping = mmap.mmap(block._fd, block.size, access=mmap.ACCESS_READ)
+        else:
+            mapping = mmap.mmap(-1, block.size, tagname=block.name, access=mmap.ACCESS_READ)
+    finally:
+        block.close()
+
+    dimension, n, height, root = _parse_header(mapping[:HEADER_SIZE], name)
+    arrays = {}
+
+    for array_name, dtype, shape, offset in _layout(dimension, n)[0]:
+        arrays[array_name] = np.ndarray(shape, dtype=dtype, buffer=mapping, offset=offset)
+
+    return FlatTree(arrays['points'], arrays['indices'], arrays['pivot'], arrays['split_axis'],
+                    arrays['children_left'], arrays['children_right'],
+                    arrays['start'], arrays['end'], height, root)
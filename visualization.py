@@ -8,6 +8,7 @@
 """
 from scipy.spatial import ConvexHull
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
 from matplotlib.patches import Rectangle
 from math import floor
 from discrete_slider import DiscreteSlider
@@ -20,7 +21,7 @@ def calculate_vector_coordinates(x, y):
     return (x[0], y[0]), (x[1] - x[0], y[1] - y[0])
 
 
-def visualize_bound(bound_coordinate, curr_axis, up_left_direction, axes, x_lims, y_lims, width, color):
+def bound_vector(bound_coordinate, curr_axis, up_left_direction, x_lims, y_lims):
     bound_point = [bound_coordinate, bound_coordinate]
 
     if curr_axis == 0:
@@ -35,7 +36,11 @@ def visualize_bound(bound_coordinate, curr_axis, up_left_direction, axes, x_lims
     else:
         x = sorted(x, reverse=up_left_direction)
 
-    start_point, end_point = calculate_vector_coordinates(x, y)
+    return calculate_vector_coordinates(x, y)
+
+
+def visualize_bound(bound_coordinate, curr_axis, up_left_direction, axes, x_lims, y_lims, width, color):
+    start_point, end_point = bound_vector(bound_coordinate, curr_axis, up_left_direction, x_lims, y_lims)
 
     axes.quiver(*start_point, *end_point, angles='xy', scale_units='xy', scale=1, color=color)
 
@@ -79,21 +84,22 @@ def visualize_2d_tree(tree):
 
 def split_tree_by_levels(tree):
     nodes_info_map = {}
+    stack = [(tree, 1)]
+
+    while stack:
+        node, level = stack.pop()
 
-    def iter(node, level):
         if node:
             if level in nodes_info_map.keys():
                 nodes_info_map[level].append(node.data)
             else:
                 nodes_info_map[level] = [node.data]
 
-        if node.left:
-            iter(node.left, level + 1)
-
         if node.right:
-            iter(node.right, level + 1)
+            stack.append((node.right, level + 1))
 
-    iter(tree, 1)
+        if node.left:
+            stack.append((node.left, level + 1))
 
     return nodes_info_map
 
@@ -118,78 +124,138 @@ def calculate_lims(tree):
     return (xmin - 0.3, xmax + 0.3), (ymin - 0.3, ymax + 0.3)
 
 
-def plot_points(points, visualize_bounds, axes, style):
-    for point in points:
+def create_level_artists(axes, tree):
+    """
+    Creates the artists of every level of the tree once
+
+    Returns a list with a pair of artist lists per level: the ones shown
+    once the slider has reached the level (its points in blue and the
+    split bounds of its nodes) and the one shown before (its points in
+    red). Every list holds one artist for the whole level, so drawing a
+    level costs a single call however many nodes it has.
+    """
+
+    nodes_info = split_tree_by_levels(create_visualization_tree(tree))
+    levels = []
 
-        if len(point['point']) == 0:
+    for level in range(1, max(nodes_info.keys()) + 1):
+        nodes = [x for x in nodes_info[level] if len(x['point'])]
+
+        if not nodes:
             continue
 
-        axes.plot(point['point'][0], point['point'][1], style)
+        points = np.array([x['point'] for x in nodes])
+        vectors = np.array([bound_vector(x['point'][x['curr_axis']], x['curr_axis'], x['up_left_direction'],
+                                         x['x_lims'], x['y_lims']) for x in nodes])
 
-        if visualize_bounds:
-            point_data = point['point']
-            curr_axis = point['curr_axis']
-            up_left_direction = point['up_left_direction']
-            x_lims = point['x_lims']
-            y_lims = point['y_lims']
-            color = point['color']
+        reached = [axes.plot(points[:, 0], points[:, 1], 'b*')[0],
+                   axes.quiver(vectors[:, 0, 0], vectors[:, 0, 1], vectors[:, 1, 0], vectors[:, 1, 1],
+                               angles='xy', scale_units='xy', scale=1, color=[x['color'] for x in nodes])]
+        pending = [axes.plot(points[:, 0], points[:, 1], 'r*')[0]]
 
-            visualize_bound(point_data[curr_axis], curr_axis, up_left_direction,
-                            axes, x_lims, y_lims, -1, color)
+        levels.append((reached, pending))
+
+    return levels
+
+
+def visualize_2d_tree_by_levels(tree, show=True):
+    """
+    Shows the tree with a slider selecting how many levels are drawn with
+    their split bounds
 
+    The hull and the artists of all levels are created once. The levels
+    are animated artists left out of regular draws: a slider move only
+    switches their visibility and blits them over a saved background of
+    the static part of the figure. Returns the slider.
+    """
 
-def visualize_2d_tree_by_levels(tree):
     data = np.array([x.data for x in tree.level_order()])
 
     plt.subplots_adjust(left=0.15, bottom=0.25)
 
     axes_nodes = plt.axes()
+    canvas = axes_nodes.figure.canvas
 
     xlim, ylim = calculate_lims(tree)
 
     axes_nodes.set_xlim(xlim)
     axes_nodes.set_ylim(ylim)
 
-    visualization_tree = create_visualization_tree(tree)
+    hull = ConvexHull(data)
+    axes_nodes.add_collection(LineCollection(data[hull.simplices], colors='k'))
 
-    nodes_info = split_tree_by_levels(visualization_tree)
+    levels = create_level_artists(axes_nodes, tree)
+    artists = [artist for reached, pending in levels for artist in reached + pending]
 
-    axes = plt.axes([0.15, 0.1, 0.2, 0.03])
+    for artist in artists:
+        artist.set_animated(True)
 
-    slider_levels = DiscreteSlider(axes, 'Levels number', 0, tree.height, valinit=0, valfmt='%d')
+    background = [None]
 
-    axes_level_nodes = plt.axes()
+    def draw_levels():
+        for artist in artists:
+            if artist.get_visible():
+                axes_nodes.draw_artist(artist)
 
-    hull = ConvexHull(data)
+    def on_draw(event):
+        background[0] = canvas.copy_from_bbox(axes_nodes.bbox)
+        draw_levels()
+
+    canvas.mpl_connect('draw_event', on_draw)
 
     def update(value):
-        axes_level_nodes.cla()
+        curr_level = floor(value)
 
-        for simplex in hull.simplices:
-            plt.plot(data[simplex, 0], data[simplex, 1], 'k-')
+        for i, (reached, pending) in enumerate(levels, 1):
+            for artist in reached:
+                artist.set_visible(i <= curr_level)
 
-        curr_level = floor(value)
+            for artist in pending:
+                artist.set_visible(i > curr_level)
 
-        for i in range(1, max(nodes_info.keys()) + 1):
-            if i < curr_level + 1:
-                plot_points(nodes_info[i], True, axes_level_nodes, 'b*')
-            else:
-                plot_points(nodes_info[i], False, axes_level_nodes, 'r*')
+        if background[0] is None or not canvas.supports_blit:
+            canvas.draw_idle()
+            return
+
+        canvas.restore_region(background[0])
+        draw_levels()
+        canvas.blit(axes_nodes.bbox)
 
-        axes_nodes.set_xlim(xlim)
-        axes_nodes.set_ylim(ylim)
+    update(0)
 
-        plt.draw()
+    axes = plt.axes([0.15, 0.1, 0.2, 0.03])
 
+    slider_levels = DiscreteSlider(axes, 'Levels number', 0, tree.height, valinit=0, valfmt='%d')
     slider_levels.on_changed(update)
-    plt.show()
+
+    if show:
+        plt.show()
+
+    return slider_levels
 
 
 def create_visualization_tree(tree):
-    def create_visualization_node(node, x_lims, y_lims, curr_axis=0, is_left_node=True, color='r'):
+    # the nodes are described top-down with an explicit stack and created
+    # bottom-up; an empty node becomes a leaf carrying only its area
+    xlim, ylim = calculate_lims(tree)
+
+    records = []
+    stack = [(tree, xlim, ylim, 0, True, 'r', None, None)]
+
+    while stack:
+        node, x_lims, y_lims, curr_axis, is_left_node, color, parent, side = stack.pop()
+
+        if parent is not None:
+            records[parent][side] = len(records)
+
         if not node:
-            return Node({'point': tuple(), 'x_lims': x_lims, 'y_lims': y_lims,
-                         'color': color}, None, None)
+            records.append([{'point': tuple(), 'x_lims': x_lims, 'y_lims': y_lims,
+                             'color': color}, None, None])
+            continue
+
+        records.append([{'point': node.data, 'up_left_direction': is_left_node, 'curr_axis': curr_axis,
+                         'x_lims': x_lims, 'y_lims': y_lims, 'color': color}, None, None])
+        index = len(records) - 1
 
         x_lims_left = (x_lims[0], node.data[0])
         x_lims_right = (node.data[0], x_lims[1])
@@ -219,15 +285,18 @@ def create_visualization_tree(tree):
 
         next_axis = (curr_axis + 1) % 2
 
-        left = create_visualization_node(node.left, next_left_x_lims, next_left_y_lims,
-                                         next_axis, left_node_flag, left_side_color)
-        right = create_visualization_node(node.right, next_right_x_lims, next_right_y_lims,
-                                          next_axis, not left_node_flag, right_side_color)
+        stack.append((node.right, next_right_x_lims, next_right_y_lims,
+                      next_axis, not left_node_flag, right_side_color, index, 2))
+        stack.append((node.left, next_left_x_lims, next_left_y_lims,
+                      next_axis, left_node_flag, left_side_color, index, 1))
 
-        return Node({'point': node.data, 'up_left_direction': is_left_node, 'curr_axis': curr_axis,
-                     'x_lims': x_lims, 'y_lims': y_lims, 'color': color},
-                    left, right)
+    nodes = [None] * len(records)
 
-    xlim, ylim = calculate_lims(tree)
+    for i in range(len(records) - 1, -1, -1):
+        data, left, right = records[i]
+
+        nodes[i] = Node(data,
+                        None if left is None else nodes[left],
+                        None if right is None else nodes[right])
 
-    return create_visualization_node(tree, xlim, ylim)
+    return nodes[0]